@@ -1,14 +1,27 @@
-import os
-from groq import Groq
 from utils.code_files.retriever import rag_retriever
-from typing import List, Any
+from core.clients import ClientRegistry, get_registry
+from core.executor import run_blocking
+from core.context_window import ContextWindow
+from core.semantic_cache import semantic_cache
+from core.relevance import relevance_mask, gate_documents
+from typing import List, Any, Dict, Optional
+
+# MODEL_NAME = "llama-3.3-70b-versatile"  # Use original model
+MODEL_NAME = "meta-llama/llama-4-maverick-17b-128e-instruct"  # Use original model
 
 class Agent:
-    def __init__(self):
-        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    """Lightweight per-conversation state; API clients are borrowed from the shared registry."""
+
+    def __init__(self, clients: ClientRegistry = None):
+        clients = clients or get_registry()
+        self.client = clients.groq
+        self.async_client = clients.async_groq
         self.messages = []
         self.has_system_prompt = False
         self.user_id = None
+        self.context_window = ContextWindow(MODEL_NAME)
+        self.dropped_turns = 0
+        self.context_tokens_saved = 0
 
     def set_user_id(self, user_id: str):
         """Set the user ID for this agent instance."""
@@ -21,17 +34,47 @@ class Agent:
         self.messages.append({"role": "system", "content": prompt})
         self.has_system_prompt = True
 
+    def set_summary(self, summary: str):
+        """Add the rolling summary of earlier turns that are no longer replayed verbatim."""
+        if not self.has_system_prompt:
+            raise ValueError("System prompt is required before adding a conversation summary.")
+        self.messages.append({
+            "role": "system",
+            "content": f"--- SUMMARY OF EARLIER CONVERSATION ---\n{summary.strip()}"
+        })
+
+    def add_history(self, message: dict):
+        """Append a stored conversation message, keeping its cached token count if any."""
+        history_message = {"role": message["role"], "content": message["content"]}
+        if "tokens" in message:
+            history_message["tokens"] = message["tokens"]
+        self.messages.append(history_message)
+
+    def has_history(self) -> bool:
+        """Whether any earlier user/assistant turns (or a summary) are loaded."""
+        return len(self.messages) > 1
+
+    async def _acache_lookup(self, message: str, filters: Optional[Dict] = None):
+        """Consult the semantic cache; only unscoped first turns are eligible since replies depend on history."""
+        if semantic_cache is None or self.has_history() or filters:
+            return None
+        try:
+            return await semantic_cache.lookup(message)
+        except Exception:
+            # The cache is an optimization; fall through to normal generation
+            return None
+
+    def _use_cached_reply(self, message: str, response: str):
+        self.messages.append({"role": "user", "content": message})
+        self.messages.append({"role": "assistant", "content": response})
+
+    def _llm_messages(self) -> List[dict]:
+        """Messages in the shape the Groq API expects (bookkeeping keys stripped)."""
+        return [{"role": m["role"], "content": m["content"]} for m in self.messages]
+
     def is_context_relevant(self, user_input: str, retrieved_docs: List[Any]) -> bool:
-        """Check if retrieved context is relevant using keyword matching."""
-        if not retrieved_docs:
-            return False
-        user_words = set(user_input.lower().split())
-        for doc in retrieved_docs:
-            doc_words = set(doc.page_content.lower().split())
-            common_words = user_words.intersection(doc_words)
-            if len(common_words) / len(user_words) > 0.2:
-                return True
-        return False
+        """Check if any retrieved document clears the per-stage retrieval score thresholds."""
+        return bool(relevance_mask(retrieved_docs).any())
 
     def format_context(self, retrieved_docs: List[Any]) -> str:
         """Format retrieved documents into context and source citations."""
@@ -45,6 +88,12 @@ class Agent:
             topic = doc.metadata.get("topic", "Unknown Topic")
             book = doc.metadata.get("book_name", "Unknown Book")
             page = doc.metadata.get("page_number", "N/A")
+            also_pages = doc.metadata.get("also_pages")
+            if isinstance(also_pages, float):
+                # A single extra page comes back from CSV as a number (NaN when there is none)
+                also_pages = None if also_pages != also_pages else int(also_pages)
+            if also_pages:
+                page = f"{page} (also {also_pages})"
             context_text += f"[{i}] {book} - {section} | Topic: {topic} | Page: {page}\n"
             relevant_context.append(doc.page_content)
 
@@ -55,9 +104,8 @@ class Agent:
         """Invoke the Groq API with streaming."""
         try:
             response = self.client.chat.completions.create(
-                messages=self.messages,
-                # model="llama-3.3-70b-versatile",  # Use original model
-                model="meta-llama/llama-4-maverick-17b-128e-instruct",  # Use original model
+                messages=self._llm_messages(),
+                model=MODEL_NAME,
                 stream=True,
                 temperature=0.4
             )
@@ -67,34 +115,68 @@ class Agent:
             self.messages.append({"role": "assistant", "content": error_message})
             return None
 
-    def chat(self, message: str):
-        """Process a user message with RAG context and return the assistant's response."""
-        if not self.has_system_prompt:
-            raise ValueError("System prompt is required before starting a conversation.")
+    async def _ainvoke(self):
+        """Invoke the Groq API with streaming, without blocking the event loop."""
+        try:
+            response = await self.async_client.chat.completions.create(
+                messages=self._llm_messages(),
+                model=MODEL_NAME,
+                stream=True,
+                temperature=0.4
+            )
+            return response
+        except Exception as e:
+            error_message = f"I encountered an error: {str(e)}. Please try again with a different query."
+            self.messages.append({"role": "assistant", "content": error_message})
+            return None
 
-        # Retrieve relevant docs using RAG
-        retrieved_docs = rag_retriever.invoke(message)
-        context_relevant = self.is_context_relevant(message, retrieved_docs)
+    def _build_user_input(self, message: str, retrieved_docs: List[Any]) -> str:
+        """Combine the user message with the relevant retrieved context (or a no-context note)."""
+        relevant_docs, self.context_tokens_saved = gate_documents(retrieved_docs)
 
-        if not context_relevant:
-            full_input = (
+        if not relevant_docs:
+            return (
                 f"{message.strip()}\n\n"
                 f"--- SYSTEM NOTE: No relevant context was retrieved. Please provide a general, supportive response. ---"
             )
-        else:
-            context = self.format_context(retrieved_docs)
-            full_input = (
-                f"{message.strip()}\n\n"
-                f"--- SYSTEM NOTE: The following clinical knowledge base context was retrieved. Use it to inform your response. Don't Cite it if used. ---\n"
-                f"{context}"
-            )
+        context = self.format_context(relevant_docs)
+        return (
+            f"{message.strip()}\n\n"
+            f"--- SYSTEM NOTE: The following clinical knowledge base context was retrieved. Use it to inform your response. Don't Cite it if used. ---\n"
+            f"{context}"
+        )
+
+    def _prepare_turn(self, message: str, filters: Optional[Dict] = None):
+        """Retrieve RAG context for the message and append the LLM-facing user turn.
+
+        `filters` optionally scopes retrieval by topic, section_title, book_name or book_type.
+        """
+        if not self.has_system_prompt:
+            raise ValueError("System prompt is required before starting a conversation.")
+
+        # Retrieve relevant docs using RAG
+        retrieved_docs = rag_retriever.invoke(message, filters=filters)
 
         # Append the full input (user message + context) to messages for the LLM
-        self.messages.append({"role": "user", "content": full_input})
+        self.messages.append({"role": "user", "content": self._build_user_input(message, retrieved_docs)})
+        self.messages, self.dropped_turns = self.context_window.fit(self.messages)
+
+    async def _aprepare_turn(self, message: str, filters: Optional[Dict] = None):
+        """Async variant of `_prepare_turn`; retrieval runs on the bounded executor."""
+        if not self.has_system_prompt:
+            raise ValueError("System prompt is required before starting a conversation.")
+
+        retrieved_docs = await run_blocking(rag_retriever.invoke, message, filters=filters)
+        self.messages.append({"role": "user", "content": self._build_user_input(message, retrieved_docs)})
+        self.messages, self.dropped_turns = self.context_window.fit(self.messages)
+
+    def chat(self, message: str, filters: Optional[Dict] = None):
+        """Process a user message with RAG context and return the assistant's response."""
+        self._prepare_turn(message, filters)
 
         response = self._invoke()
         if response is None:
-            return self.messages[-1]["content"]
+            return self.messages[-1]["content"], message
 
         # Collect streamed response
         response_message = ""
@@ -103,4 +185,81 @@ class Agent:
                 response_message += chunk.choices[0].delta.content
 
         self.messages.append({"role": "assistant", "content": response_message})
-        return response_message, message  # Return both response and original user message
\ No newline at end of file
+        return response_message, message  # Return both response and original user message
+
+    def stream_chat(self, message: str, filters: Optional[Dict] = None):
+        """Process a user message with RAG context and yield response deltas as they arrive.
+
+        The assistant message is appended to the history once the stream is exhausted.
+        Closing the generator early closes the upstream Groq stream as well.
+        """
+        self._prepare_turn(message, filters)
+
+        response = self._invoke()
+        if response is None:
+            yield self.messages[-1]["content"]
+            return
+
+        response_message = ""
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    response_message += delta
+                    yield delta
+        finally:
+            response.close()
+
+        self.messages.append({"role": "assistant", "content": response_message})
+
+    async def achat(self, message: str, filters: Optional[Dict] = None):
+        """Async variant of `chat` for use inside request handlers."""
+        lookup = await self._acache_lookup(message, filters)
+        if lookup and lookup.response is not None:
+            self._use_cached_reply(message, lookup.response)
+            return lookup.response, message
+
+        await self._aprepare_turn(message, filters)
+
+        response = await self._ainvoke()
+        if response is None:
+            return self.messages[-1]["content"], message
+
+        response_message = ""
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                response_message += chunk.choices[0].delta.content
+
+        self.messages.append({"role": "assistant", "content": response_message})
+        if lookup and response_message:
+            semantic_cache.store(lookup, response_message)
+        return response_message, message
+
+    async def astream_chat(self, message: str, filters: Optional[Dict] = None):
+        """Async variant of `stream_chat`; closing the generator closes the upstream stream."""
+        lookup = await self._acache_lookup(message, filters)
+        if lookup and lookup.response is not None:
+            self._use_cached_reply(message, lookup.response)
+            yield lookup.response
+            return
+
+        await self._aprepare_turn(message, filters)
+
+        response = await self._ainvoke()
+        if response is None:
+            yield self.messages[-1]["content"]
+            return
+
+        response_message = ""
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    response_message += delta
+                    yield delta
+        finally:
+            await response.close()
+
+        self.messages.append({"role": "assistant", "content": response_message})
+        if lookup and response_message:
+            semantic_cache.store(lookup, response_message)
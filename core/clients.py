@@ -0,0 +1,137 @@
+import os
+import threading
+import importlib.util
+import httpx
+from requests.adapters import HTTPAdapter
+from groq import Groq, AsyncGroq
+
+# Shared HTTP pool settings for all outbound API clients (Groq, Jina, Cohere)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+# HTTP/2 needs the optional `h2` package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+class ConnectionStats:
+    """Counts requests and newly opened connections so pool reuse can be monitored."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+
+    async def _atrace(self, event_name: str, info: dict):
+        self._trace(event_name, info)
+
+    def on_request(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def aon_request(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._atrace
+
+    def snapshot(self) -> dict:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+        }
+
+class ClientRegistry:
+    """Process-wide API clients sharing keep-alive connection pools.
+
+    Agents borrow `groq`/`async_groq` from here instead of building their own clients; the
+    retriever pulls `http_adapter` (Jina) and `http_client` (Cohere) when its runtime loads.
+    """
+
+    def __init__(self):
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.http2 = HTTP2_ENABLED and HTTP2_AVAILABLE
+
+        self.http_stats = ConnectionStats()
+        self.async_http_stats = ConnectionStats()
+        self.http_client = httpx.Client(
+            limits=limits, timeout=timeout, http2=self.http2,
+            event_hooks={"request": [self.http_stats.on_request]}
+        )
+        self.async_http_client = httpx.AsyncClient(
+            limits=limits, timeout=timeout, http2=self.http2,
+            event_hooks={"request": [self.async_http_stats.aon_request]}
+        )
+
+        api_key = os.environ.get("GROQ_API_KEY")
+        self.groq = Groq(api_key=api_key, http_client=self.http_client)
+        self.async_groq = AsyncGroq(api_key=api_key, http_client=self.async_http_client)
+
+        # The Jina embeddings client is requests-based; give it a pooled keep-alive adapter
+        self.http_adapter = HTTPAdapter(pool_connections=HTTP_MAX_KEEPALIVE, pool_maxsize=HTTP_MAX_CONNECTIONS)
+
+    def _adapter_stats(self) -> dict:
+        requests_sent = 0
+        connections_opened = 0
+        pools = self.http_adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        reused = max(requests_sent - connections_opened, 0)
+        return {
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "reuse_ratio": round(reused / requests_sent, 4) if requests_sent else 0.0,
+        }
+
+    def stats(self) -> dict:
+        """Connection-reuse statistics for each shared pool."""
+        return {
+            "http2": self.http2,
+            "httpx_sync": self.http_stats.snapshot(),
+            "httpx_async": self.async_http_stats.snapshot(),
+            "requests_adapter": self._adapter_stats(),
+        }
+
+    async def aclose(self):
+        self.http_client.close()
+        await self.async_http_client.aclose()
+        self.http_adapter.close()
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def init_registry() -> ClientRegistry:
+    """Create the shared registry (idempotent); called at app startup."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+    return _registry
+
+def get_registry() -> ClientRegistry:
+    """Return the shared registry, creating it on first use outside the app (e.g. scripts)."""
+    return _registry or init_registry()
+
+async def close_registry():
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+        _registry = None
@@ -0,0 +1,104 @@
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Tuple
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+def _parse_budgets(spec: str) -> dict:
+    """Parse "model=tokens,model=tokens" into {model: tokens}."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, tokens = item.rpartition("=")
+        budgets[model.strip()] = int(tokens)
+    return budgets
+
+# Prompt token budgets per model; the remainder of the model context is left for the reply.
+# CONTEXT_TOKEN_BUDGETS overrides single models ("model=tokens,..."); CONTEXT_TOKEN_BUDGET, when
+# set, applies to every model.
+MODEL_TOKEN_BUDGETS = {
+    "meta-llama/llama-4-maverick-17b-128e-instruct": 24000,
+    "llama-3.3-70b-versatile": 24000,
+    "llama-3.1-8b-instant": 8000,
+    **_parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", "")),
+}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0")) or None
+DEFAULT_TOKEN_BUDGET = 8000
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+
+# Approximate per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# cl100k_base is not Llama's tokenizer but is close enough for budgeting
+tokenizer = tiktoken.get_encoding("cl100k_base")
+
+_token_cache = OrderedDict()
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text, memoizing by content hash so repeated turns are not re-tokenized."""
+    key = hashlib.sha1(text.encode("utf-8")).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        _token_cache.move_to_end(key)
+        return cached
+    count = len(tokenizer.encode(text, disallowed_special=()))
+    _token_cache[key] = count
+    if len(_token_cache) > TOKEN_COUNT_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return count
+
+class ContextWindow:
+    """Keeps the prompt for one model within its token budget by dropping the oldest turns."""
+
+    def __init__(self, model: str, budget: int = None):
+        self.model = model
+        self.budget = budget or CONTEXT_TOKEN_BUDGET or MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+    def count_message(self, message: dict) -> int:
+        """Token cost of one chat message; uses a stored `tokens` count when present."""
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = count_tokens(message["content"])
+        return tokens + MESSAGE_OVERHEAD_TOKENS
+
+    def fit(self, messages: List[dict]) -> Tuple[List[dict], int]:
+        """Trim history so the messages fit the budget.
+
+        Leading system messages and the final (current) message are always kept. History is
+        kept newest-first in whole turns (a user message plus its replies) until the budget
+        is reached. Returns the kept messages and the number of turns dropped.
+        """
+        head_len = 0
+        while head_len < len(messages) - 1 and messages[head_len]["role"] == "system":
+            head_len += 1
+        head = messages[:head_len]
+        history = messages[head_len:-1]
+        tail = messages[-1:]
+
+        used = sum(self.count_message(m) for m in head + tail)
+
+        turns = []
+        for msg in history:
+            if msg["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(msg)
+
+        kept = []
+        kept_turns = 0
+        for turn in reversed(turns):
+            cost = sum(self.count_message(m) for m in turn)
+            if used + cost > self.budget:
+                break
+            kept = turn + kept
+            used += cost
+            kept_turns += 1
+
+        dropped_turns = len(turns) - kept_turns
+        if dropped_turns:
+            logger.info(
+                "Context window for %s: dropped %d of %d turns (%d/%d tokens)",
+                self.model, dropped_turns, len(turns), used, self.budget
+            )
+        return head + kept + tail, dropped_turns
@@ -0,0 +1,34 @@
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from core.database import conversations, counter_collection
+
+async def _seed_session_counter(user_id: ObjectId):
+    # Users whose chats predate the counter continue after their highest session_index
+    latest_chat = await conversations.find_one(
+        {"userId": user_id, "session_index": {"$exists": True}},
+        {"session_index": 1},
+        sort=[("session_index", -1)]
+    )
+    try:
+        await counter_collection.insert_one({
+            "_id": user_id,
+            "session_index": latest_chat["session_index"] if latest_chat else 0
+        })
+    except DuplicateKeyError:
+        pass  # A concurrent request seeded it first
+
+async def next_session_index(user_id: str) -> int:
+    """Reserve the user's next chat session number; concurrent callers always get distinct numbers."""
+    user_id = ObjectId(user_id)
+    for _ in range(2):
+        counter = await counter_collection.find_one_and_update(
+            {"_id": user_id},
+            {"$inc": {"session_index": 1}},
+            projection={"session_index": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if counter:
+            return counter["session_index"]
+        await _seed_session_counter(user_id)
+    raise RuntimeError(f"Could not allocate a session index for user {user_id}")
@@ -1,12 +1,26 @@
 # D:\ProductBox\inovient\Morpheus-v2\core\database.py
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
 import os
 
 DATABASE_URI = os.getenv("DATABASE_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
-client = MongoClient(DATABASE_URI)
+# Connection pool settings for the async driver
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+client = AsyncMongoClient(
+    DATABASE_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS
+)
 db = client[DATABASE_NAME]
 
 conversations = db["conversations"]
-user_collection = db["users"]
\ No newline at end of file
+# One document per chat message, keyed by chat_id (see core/messages.py)
+message_collection = db["messages"]
+user_collection = db["users"]
+# Per-user atomic sequence numbers (see core/counters.py)
+counter_collection = db["counters"]
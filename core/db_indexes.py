@@ -0,0 +1,89 @@
+import os
+import logging
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from core.database import db
+from core.messages import MESSAGE_INDEX, LEGACY_MESSAGE_INDEX
+from core.semantic_cache import SEMANTIC_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+
+# Create any missing indexes at startup; disable where the app user lacks createIndex rights
+DB_ENSURE_INDEXES = os.getenv("DB_ENSURE_INDEXES", "1") == "1"
+
+# collection -> [(keys, options)]; every query path that sorts or filters per user is covered
+INDEXES: Dict[str, List[tuple]] = {
+    "conversations": [
+        ([("userId", ASCENDING), ("updatedAt", DESCENDING)], {"name": "userId_updatedAt"}),
+        ([("userId", ASCENDING), ("session_index", DESCENDING)], {"name": "userId_session_index"}),
+    ],
+    "users": [
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+    "messages": [
+        (MESSAGE_INDEX, {"name": "chat_id_createdAt"}),
+        (LEGACY_MESSAGE_INDEX, {"name": "chat_id_legacy_index", "unique": True,
+                                "partialFilterExpression": {"legacy_index": {"$exists": True}}}),
+    ],
+    "semantic_cache": [
+        ([("prompt_version", ASCENDING), ("embeddings_model", ASCENDING), ("createdAt", DESCENDING)],
+         {"name": "prompt_model_createdAt"}),
+        # MongoDB deletes entries once they outlive the cache TTL
+        ([("createdAt", ASCENDING)], {"name": "createdAt_ttl", "expireAfterSeconds": SEMANTIC_CACHE_TTL_SECONDS}),
+    ],
+}
+
+# Result of the last startup check, exposed through /metrics
+_status = {"checked": False, "missing": [], "errors": []}
+
+async def ensure_indexes() -> List[str]:
+    """Create the indexes in INDEXES (a no-op for those that already exist); returns failures."""
+    errors = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                    # A changed TTL is applied in place instead of rebuilding the index
+                    await db.command("collMod", collection, index={
+                        "name": options["name"], "expireAfterSeconds": options["expireAfterSeconds"]
+                    })
+                else:
+                    errors.append(f"{collection}.{options['name']}: {e}")
+            except PyMongoError as e:
+                # e.g. duplicate emails already stored block the unique index
+                errors.append(f"{collection}.{options['name']}: {e}")
+    return errors
+
+async def missing_indexes() -> List[str]:
+    """`collection.name` of every index in INDEXES whose key pattern the collection lacks."""
+    missing = []
+    for collection, indexes in INDEXES.items():
+        existing = await db[collection].index_information()
+        patterns = {
+            tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                  for field, direction in info["key"])
+            for info in existing.values()
+        }
+        for keys, options in indexes:
+            if tuple(keys) not in patterns:
+                missing.append(f"{collection}.{options['name']}")
+    return missing
+
+async def bootstrap_indexes() -> dict:
+    """Startup hook: create indexes (unless disabled), then report any that are still missing."""
+    errors = await ensure_indexes() if DB_ENSURE_INDEXES else []
+    missing = await missing_indexes()
+    for error in errors:
+        logger.warning("Index creation failed: %s", error)
+    if missing:
+        logger.warning("Missing MongoDB indexes: %s", ", ".join(missing))
+    _status.update({"checked": True, "missing": missing, "errors": errors})
+    return dict(_status)
+
+def index_status() -> dict:
+    return dict(_status)
@@ -0,0 +1,18 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Upper bound on threads used for blocking work (retrieval, embeddings, CPU-bound scoring)
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="psyra-blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the bounded executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+def shutdown_executor():
+    """Stop accepting new blocking work and wait for running jobs to finish."""
+    _executor.shutdown(wait=True)
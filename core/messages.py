@@ -0,0 +1,153 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from core.database import conversations, message_collection
+
+logger = logging.getLogger(__name__)
+
+# Default and largest page returned by the messages endpoint
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+MESSAGE_PAGE_MAX = int(os.getenv("MESSAGE_PAGE_MAX", "200"))
+# Most messages replayed into the agent per turn; anything older is covered by the rolling summary
+MESSAGE_HISTORY_LIMIT = int(os.getenv("MESSAGE_HISTORY_LIMIT", "40"))
+
+# Chat metadata without message bodies. `$slice: 0` keeps a legacy embedded array visible
+# (as an empty list) so it can be migrated, without transferring its contents.
+CHAT_METADATA_PROJECTION = {"messages": {"$slice": 0}}
+
+# Messages of one chat in order; `_id` breaks ties between messages stored in the same millisecond
+MESSAGE_INDEX = [("chat_id", ASCENDING), ("createdAt", ASCENDING), ("_id", ASCENDING)]
+# Position of a message copied from a legacy embedded array; makes the copy idempotent
+LEGACY_MESSAGE_INDEX = [("chat_id", ASCENDING), ("legacy_index", ASCENDING)]
+_OLDEST_FIRST = [("createdAt", ASCENDING), ("_id", ASCENDING)]
+_NEWEST_FIRST = [("createdAt", DESCENDING), ("_id", DESCENDING)]
+_EPOCH = datetime(1970, 1, 1)
+
+# === Cursors ===
+def encode_cursor(message: dict) -> str:
+    """Opaque position of a message: its creation time in ms and its id."""
+    millis = (message["createdAt"] - _EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}-{message['_id']}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        millis, message_id = cursor.split("-", 1)
+        return _EPOCH + timedelta(milliseconds=int(millis)), ObjectId(message_id)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def _before(created_at: datetime, message_id: ObjectId) -> dict:
+    return {"$or": [
+        {"createdAt": {"$lt": created_at}},
+        {"createdAt": created_at, "_id": {"$lt": message_id}}
+    ]}
+
+# === Chats ===
+async def load_chat(chat_id: str, user_id: str) -> Optional[dict]:
+    """Chat metadata (no message bodies) if it belongs to the user; migrates legacy embedded messages."""
+    chat = await conversations.find_one(
+        {"_id": ObjectId(chat_id), "userId": ObjectId(user_id)},
+        CHAT_METADATA_PROJECTION
+    )
+    if chat and "messages" in chat:
+        chat = await _migrate_embedded_messages(chat)
+    return chat
+
+async def _migrate_embedded_messages(chat: dict) -> dict:
+    """Move a chat's embedded `messages` array into the messages collection (one-off per chat).
+
+    The copy is keyed on (chat_id, legacy_index) and written with upserts, so an interrupted or
+    concurrent migration can simply run again. The array is only removed, and the count only
+    moved, once every message is in the collection.
+    """
+    legacy = await conversations.find_one({"_id": chat["_id"]}, {"messages": 1})
+    embedded = (legacy or {}).get("messages") or []
+
+    if embedded:
+        await message_collection.bulk_write([
+            UpdateOne(
+                {"chat_id": chat["_id"], "legacy_index": i},
+                {"$setOnInsert": {
+                    "_id": ObjectId(),  # Generated in order so `_id` tie-breaks keep the original sequence
+                    "role": msg["role"],
+                    "content": msg["content"],
+                    "tokens": msg.get("tokens"),
+                    "createdAt": msg.get("createdAt") or chat.get("createdAt") or datetime.utcnow()
+                }},
+                upsert=True
+            )
+            for i, msg in enumerate(embedded)
+        ], ordered=True)
+
+    # Guarded on the array still existing, so only one migration bumps the count
+    finish = await conversations.update_one(
+        {"_id": chat["_id"], "messages": {"$exists": True}},
+        {"$unset": {"messages": ""}, "$inc": {"message_count": len(embedded)}}
+    )
+    if finish.modified_count:
+        logger.info("Migrated %d embedded messages of chat %s", len(embedded), chat["_id"])
+        chat = dict(chat)
+        chat.pop("messages", None)
+        chat["message_count"] = chat.get("message_count", 0) + len(embedded)
+        return chat
+
+    # Another request finished the migration first; its count is authoritative
+    return await conversations.find_one({"_id": chat["_id"]}, CHAT_METADATA_PROJECTION)
+
+async def delete_chat_messages(chat_id: str):
+    await message_collection.delete_many({"chat_id": ObjectId(chat_id)})
+
+# === Messages ===
+async def append_messages(chat_id: str, new_messages: List[dict], update: dict):
+    """Store messages and apply `update` to the chat, bumping its message count.
+
+    Messages are inserted before the count moves, so every message counted is already readable.
+    """
+    docs = [{"chat_id": ObjectId(chat_id), **msg} for msg in new_messages]
+    await message_collection.insert_many(docs, ordered=True)
+    update.setdefault("$inc", {})["message_count"] = len(docs)
+    await conversations.update_one({"_id": ObjectId(chat_id)}, update)
+
+async def recent_messages(chat: dict, start: int = 0, limit: int = MESSAGE_HISTORY_LIMIT) -> List[dict]:
+    """Messages from position `start` onward (oldest first), capped at the newest `limit`."""
+    total = chat.get("message_count", 0)
+    count = min(total - start, limit)
+    if count <= 0:
+        return []
+    docs = await message_collection.find(
+        {"chat_id": chat["_id"]},
+        {"role": 1, "content": 1, "tokens": 1, "createdAt": 1}
+    ).sort(_NEWEST_FIRST).limit(count).to_list(length=count)
+    docs.reverse()
+    return docs
+
+async def message_range(chat_id: str, start: int, end: int) -> List[dict]:
+    """Messages at positions [start, end) of the chat, oldest first."""
+    if end <= start:
+        return []
+    return await message_collection.find(
+        {"chat_id": ObjectId(chat_id)},
+        {"role": 1, "content": 1}
+    ).sort(_OLDEST_FIRST).skip(start).limit(end - start).to_list(length=end - start)
+
+async def message_page(chat_id, before: Optional[str] = None,
+                       limit: int = MESSAGE_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """One page of messages ending just before `before` (the newest page without it), oldest first.
+
+    Returns the page and the cursor for the next older page, or None when there is none.
+    """
+    query = {"chat_id": ObjectId(chat_id)}
+    if before:
+        query.update(_before(*decode_cursor(before)))
+    docs = await message_collection.find(
+        query,
+        {"chat_id": 0, "legacy_index": 0}
+    ).sort(_NEWEST_FIRST).limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    docs.reverse()
+    return docs, (encode_cursor(docs[0]) if has_more else None)
@@ -0,0 +1,45 @@
+import os
+import logging
+from typing import Any, List, Tuple
+import numpy as np
+from core.context_window import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per-stage minimum calibrated scores a retrieved chunk needs to reach the prompt.
+# Sparse scores are the share of the query's idf mass a chunk matches (see SparseBM25.invoke),
+# so 0.5 keeps BM25-only hits that contain about half the weighted query terms.
+RELEVANCE_DENSE_MIN = float(os.getenv("RELEVANCE_DENSE_MIN", "0.45"))
+RELEVANCE_SPARSE_MIN = float(os.getenv("RELEVANCE_SPARSE_MIN", "0.5"))
+RELEVANCE_RERANK_MIN = float(os.getenv("RELEVANCE_RERANK_MIN", "0.05"))
+
+SCORE_KEYS = ("dense_score", "sparse_score", "rerank_score")
+
+def relevance_mask(retrieved_docs: List[Any]) -> np.ndarray:
+    """Boolean keep-mask over documents, from their retrieval scores in one vectorized pass.
+
+    A reranked document is judged on its rerank score alone; otherwise it is kept if either
+    the dense or the sparse branch scored it above its threshold. Missing scores count as NaN.
+    """
+    if not retrieved_docs:
+        return np.zeros(0, dtype=bool)
+    scores = np.array(
+        [[doc.metadata.get(key, np.nan) for key in SCORE_KEYS] for doc in retrieved_docs],
+        dtype=np.float64
+    )
+    dense, sparse, rerank = scores.T
+    with np.errstate(invalid="ignore"):
+        retrieval_pass = (dense >= RELEVANCE_DENSE_MIN) | (sparse >= RELEVANCE_SPARSE_MIN)
+        return np.where(np.isnan(rerank), retrieval_pass, rerank >= RELEVANCE_RERANK_MIN)
+
+def gate_documents(retrieved_docs: List[Any]) -> Tuple[List[Any], int]:
+    """Keep only documents above the relevance thresholds; returns them and the context tokens saved."""
+    mask = relevance_mask(retrieved_docs)
+    kept = [doc for doc, keep in zip(retrieved_docs, mask) if keep]
+    saved_tokens = sum(count_tokens(doc.page_content) for doc, keep in zip(retrieved_docs, mask) if not keep)
+    if retrieved_docs:
+        logger.info(
+            "Relevance gate kept %d/%d retrieved documents, saving %d context tokens",
+            len(kept), len(retrieved_docs), saved_tokens
+        )
+    return kept, saved_tokens
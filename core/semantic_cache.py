@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+import numpy as np
+from core.database import db
+from core.executor import run_blocking
+from modules.psyra_promptl4 import PSYRA_PROMPT
+from utils.code_files.retriever import embedding_backend, embedding_model
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cache for first-turn replies to near-identical questions
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# Optional second tier shared across workers and restarts
+SEMANTIC_CACHE_MONGO = os.getenv("SEMANTIC_CACHE_MONGO", "0") == "1"
+SEMANTIC_CACHE_MONGO_SCAN = int(os.getenv("SEMANTIC_CACHE_MONGO_SCAN", "500"))
+
+# Replies generated under a different system prompt must never be served
+PROMPT_VERSION = hashlib.sha256(PSYRA_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+semantic_cache_collection = db["semantic_cache"]
+
+# Keeps background writes referenced until they finish
+_background_tasks = set()
+
+class CacheLookup:
+    """Result of a cache lookup; carries the query embedding so a miss can be stored without re-embedding."""
+
+    def __init__(self, embedding: np.ndarray, response: Optional[str] = None):
+        self.embedding = embedding
+        self.response = response
+
+class SemanticCache:
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, use_mongo=SEMANTIC_CACHE_MONGO):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.use_mongo = use_mongo
+        self._entries = OrderedDict()  # key -> (embedding, response, created_at)
+        self._next_key = 0
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [k for k, (_, _, created) in self._entries.items() if created < cutoff]:
+            del self._entries[key]
+
+    def _add(self, embedding: np.ndarray, response: str, created_at: float):
+        self._entries[self._next_key] = (embedding, response, created_at)
+        self._next_key += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # least recently used
+
+    def _search_memory(self, embedding: np.ndarray) -> Optional[str]:
+        self._expire()
+        if not self._entries:
+            return None
+        keys = list(self._entries.keys())
+        matrix = np.stack([self._entries[k][0] for k in keys])
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]][1]
+
+    async def _search_mongo(self, embedding: np.ndarray) -> Optional[str]:
+        cursor = semantic_cache_collection.find(
+            {
+                "prompt_version": PROMPT_VERSION,
+                # Vectors from another embedding model are not comparable (or even the same size)
+                "embeddings_model": embedding_backend.model_name,
+                "createdAt": {"$gte": datetime.utcnow() - timedelta(seconds=self.ttl)}
+            },
+            {"embedding": 1, "response": 1, "createdAt": 1}
+        ).sort("createdAt", -1).limit(SEMANTIC_CACHE_MONGO_SCAN)
+        candidates = await cursor.to_list(length=SEMANTIC_CACHE_MONGO_SCAN)
+        if not candidates:
+            return None
+        matrix = np.asarray([c["embedding"] for c in candidates], dtype=np.float32)
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        # Promote to the in-process tier
+        self._add(matrix[best], candidates[best]["response"], time.time())
+        return candidates[best]["response"]
+
+    async def lookup(self, query: str) -> CacheLookup:
+        embedding = self._normalize(await run_blocking(embedding_model.embed_query, query))
+        response = self._search_memory(embedding)
+        if response is not None:
+            self.hits += 1
+            return CacheLookup(embedding, response)
+        if self.use_mongo:
+            try:
+                response = await self._search_mongo(embedding)
+            except Exception:
+                logger.exception("Semantic cache Mongo lookup failed")
+            if response is not None:
+                self.mongo_hits += 1
+                return CacheLookup(embedding, response)
+        self.misses += 1
+        return CacheLookup(embedding)
+
+    async def _store_mongo(self, embedding: np.ndarray, response: str):
+        try:
+            await semantic_cache_collection.insert_one({
+                "prompt_version": PROMPT_VERSION,
+                "embeddings_model": embedding_backend.model_name,
+                "embedding": embedding.tolist(),
+                "response": response,
+                "createdAt": datetime.utcnow()
+            })
+        except Exception:
+            logger.exception("Semantic cache Mongo write failed")
+
+    def store(self, lookup: CacheLookup, response: str):
+        """Cache a generated reply; the Mongo write happens in the background."""
+        self._add(lookup.embedding, response, time.time())
+        if self.use_mongo:
+            task = asyncio.create_task(self._store_mongo(lookup.embedding, response))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    def stats(self) -> dict:
+        total = self.hits + self.mongo_hits + self.misses
+        return {
+            "enabled": True,
+            "prompt_version": PROMPT_VERSION,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.mongo_hits) / total, 4) if total else 0.0,
+        }
+
+semantic_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
+
+def semantic_cache_stats() -> dict:
+    return semantic_cache.stats() if semantic_cache else {"enabled": False}
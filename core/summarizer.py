@@ -0,0 +1,88 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from bson.objectid import ObjectId
+from core.database import conversations
+from core.clients import get_registry
+from core.messages import recent_messages, message_range
+
+logger = logging.getLogger(__name__)
+
+# Summarize once this many new turns have aged out of the recent window
+SUMMARY_EVERY_N_TURNS = int(os.getenv("SUMMARY_EVERY_N_TURNS", "4"))
+# Most recent messages always sent verbatim and never folded into the summary
+SUMMARY_KEEP_RECENT_MESSAGES = int(os.getenv("SUMMARY_KEEP_RECENT_MESSAGES", "8"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+SUMMARY_PROMPT = (
+    "You maintain a concise running summary of a supportive psychology conversation between a "
+    "user and the assistant PsyRA. Update the existing summary with the new exchanges. Keep the "
+    "user's concerns, relevant personal context, emotions, techniques discussed and any agreed "
+    "next steps. Write in third person, under 250 words, with no preamble."
+)
+
+# chat_id -> running task, so a chat never has two summary updates in flight
+_pending = {}
+
+async def load_history(chat: dict):
+    """Return (summary_text, recent messages not covered by the summary) for a chat's metadata."""
+    summary = chat.get("summary") or {}
+    covered = summary.get("covered", 0)
+    return summary.get("text"), await recent_messages(chat, start=covered)
+
+def _format_exchanges(messages) -> str:
+    return "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages)
+
+async def _update_summary(chat_id: str):
+    chat = await conversations.find_one(
+        {"_id": ObjectId(chat_id)},
+        {"message_count": 1, "summary": 1}
+    )
+    if not chat:
+        return
+
+    summary = chat.get("summary") or {}
+    covered = summary.get("covered", 0)
+    cutoff = chat.get("message_count", 0) - SUMMARY_KEEP_RECENT_MESSAGES
+    if cutoff - covered < SUMMARY_EVERY_N_TURNS * 2:
+        return
+
+    # Only fold in the messages that aged out since the last update
+    new_messages = await message_range(chat_id, covered, cutoff)
+    response = await get_registry().async_groq.chat.completions.create(
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": (
+                f"Existing summary:\n{summary.get('text') or '(none yet)'}\n\n"
+                f"New exchanges:\n{_format_exchanges(new_messages)}"
+            )}
+        ],
+        model=SUMMARY_MODEL,
+        temperature=0.2
+    )
+    summary_text = response.choices[0].message.content.strip()
+
+    # Guard on `covered` so a concurrent update cannot be overwritten with an older one
+    await conversations.update_one(
+        {"_id": ObjectId(chat_id), "summary.covered": summary.get("covered")},
+        {"$set": {"summary": {
+            "text": summary_text,
+            "covered": cutoff,
+            "updatedAt": datetime.utcnow()
+        }}}
+    )
+
+async def _run_update(chat_id: str):
+    try:
+        await _update_summary(chat_id)
+    except Exception:
+        logger.exception("Rolling summary update failed for chat %s", chat_id)
+    finally:
+        _pending.pop(chat_id, None)
+
+def schedule_summary_update(chat_id: str):
+    """Refresh the chat's rolling summary in the background; never blocks the caller."""
+    if chat_id in _pending:
+        return
+    _pending[chat_id] = asyncio.create_task(_run_update(chat_id))
@@ -1,19 +1,29 @@
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from core.agent import Agent
+from core.context_window import count_tokens
+from core.summarizer import load_history, schedule_summary_update
+from core.messages import (
+    MESSAGE_PAGE_SIZE, MESSAGE_PAGE_MAX, load_chat, append_messages, message_page, delete_chat_messages
+)
 from datetime import datetime
 from bson.objectid import ObjectId
 from core.database import conversations, user_collection
-from typing import Optional
+from core.counters import next_session_index
+from typing import Optional, Dict, List, Union
+import json
 from modules.psyra_promptl4 import PSYRA_PROMPT
+from utils.code_files.metadata_filter import validate_filters
 
 chats_router = APIRouter()
 views = Jinja2Templates(directory="views")
 
 class ChatMessageRequest(BaseModel):
     message: str
+    # Optional retrieval scope, e.g. {"topic": "Anxiety"} or {"book_name": ["DSM-book"]}
+    filters: Optional[Dict[str, Union[str, List[str]]]] = None
 
 class ChatCreateRequest(BaseModel):
     title: str = "New Chat"
@@ -37,14 +47,14 @@ async def chats_page(request: Request, userId: str):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
     
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    chats = list(conversations.find(
+    chats = await conversations.find(
         {"userId": ObjectId(userId)},
         {"title": 1, "createdAt": 1, "updatedAt": 1, "session_index": 1}
-    ).sort("updatedAt", -1))
+    ).sort("updatedAt", -1).to_list(length=None)
     
     for chat in chats:
         chat["_id"] = str(chat["_id"])
@@ -66,14 +76,14 @@ async def chats_page_with_chat_id(request: Request, userId: str, chat_id: str):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
     
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    chats = list(conversations.find(
+    chats = await conversations.find(
         {"userId": ObjectId(userId)},
         {"title": 1, "createdAt": 1, "updatedAt": 1, "session_index": 1}
-    ).sort("updatedAt", -1))
+    ).sort("updatedAt", -1).to_list(length=None)
     
     for chat in chats:
         chat["_id"] = str(chat["_id"])
@@ -92,15 +102,23 @@ async def chats_page_with_chat_id(request: Request, userId: str, chat_id: str):
     )
 
 @chats_router.get("/{chat_id}/messages", response_class=JSONResponse)
-async def get_chat_messages(userId: str, chat_id: str):
+async def get_chat_messages(userId: str, chat_id: str, before: Optional[str] = None, limit: int = MESSAGE_PAGE_SIZE):
+    """Chat metadata plus one page of messages, oldest first.
+
+    Without `before` the newest page is returned; pass the response's `next_cursor` as `before`
+    to fetch the page preceding it. `next_cursor` is null once the first message is reached.
+    """
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
-    chat = conversations.find_one({
-        "_id": ObjectId(chat_id),
-        "userId": ObjectId(userId)
-    })
+    chat = await load_chat(chat_id, userId)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    try:
+        page, next_cursor = await message_page(chat_id, before, max(1, min(limit, MESSAGE_PAGE_MAX)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    chat["messages"] = page
+    chat["next_cursor"] = next_cursor
     return convert_mongo_doc(chat)
 
 @chats_router.post("", response_class=JSONResponse)
@@ -108,23 +126,19 @@ async def create_new_chat(userId: str, request: ChatCreateRequest):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
     
-    # Find the highest session_index for the user
-    latest_chat = conversations.find_one(
-        {"userId": ObjectId(userId)},
-        sort=[("session_index", -1)]
-    )
-    next_session_index = (latest_chat["session_index"] + 1) if latest_chat and "session_index" in latest_chat else 1
+    # Atomic per-user counter, so concurrent creates never share a session number
+    session_index = await next_session_index(userId)
     
     chat_data = {
         "userId": ObjectId(userId),
-        "title": f"Session {next_session_index}",
-        "session_index": next_session_index,
+        "title": f"Session {session_index}",
+        "session_index": session_index,
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow(),
-        "messages": []
+        "message_count": 0
     }
     
-    result = conversations.insert_one(chat_data)
+    result = await conversations.insert_one(chat_data)
     return {"chat_id": str(result.inserted_id)}
 
 @chats_router.patch("/{chat_id}", response_class=JSONResponse)
@@ -132,99 +146,146 @@ async def rename_chat(userId: str, chat_id: str, request: ChatRenameRequest):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
     
-    chat = conversations.find_one({
-        "_id": ObjectId(chat_id),
-        "userId": ObjectId(userId)
-    })
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    
-    conversations.update_one(
-        {"_id": ObjectId(chat_id)},
+    result = await conversations.update_one(
+        {"_id": ObjectId(chat_id), "userId": ObjectId(userId)},
         {"$set": {"title": request.title, "updatedAt": datetime.utcnow()}}
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Chat not found")
     
     return {"message": "Chat renamed successfully", "title": request.title}
 
-# RECENT_MESSAGE_LIMIT = 8
-
-@chats_router.post("/{chat_id}/message_send", response_class=JSONResponse)
-async def send_chat_message(userId: str, chat_id: str, request: ChatMessageRequest):
+async def _load_chat_for_message(userId: str, chat_id: str):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
-    if not user_collection.find_one({"_id": ObjectId(userId)}):
+    if not await user_collection.find_one({"_id": ObjectId(userId)}):
         raise HTTPException(status_code=404, detail="User not found")
     
-    chat = conversations.find_one({
-        "_id": ObjectId(chat_id),
-        "userId": ObjectId(userId)
-    })
+    chat = await load_chat(chat_id, userId)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    
+    return chat
+
+async def _build_agent(userId: str, chat):
     agent = Agent()
     agent.set_user_id(userId)
     agent.system_prompt(PSYRA_PROMPT)
 
-    # Load recent messages for context
-    # recent_messages = chat["messages"][-RECENT_MESSAGE_LIMIT:] # load previous limited messages
-    recent_messages = chat["messages"][:] # load all messages
-
+    # Earlier turns are represented by the rolling summary; only the rest is replayed.
+    # The agent then trims that history to the model's token budget each turn.
+    summary, recent_messages = await load_history(chat)
+    if summary:
+        agent.set_summary(summary)
     for msg in recent_messages:
-        agent.messages.append({"role": msg["role"], "content": msg["content"]})
-    
-    # Get response and original user message
-    response, original_user_message = agent.chat(request.message)
-    
+        agent.add_history(msg)
+    return agent
+
+async def _store_turn(userId: str, chat_id: str, chat, original_user_message: str, response: str):
     # Store messages in MongoDB
     user_message = {
         "role": "user",
         "content": original_user_message,  # Store only the user's input
+        "tokens": count_tokens(original_user_message),  # Cached for context-window budgeting
         "createdAt": datetime.utcnow()
     }
     
     ai_message = {
         "role": "assistant",
         "content": response,
+        "tokens": count_tokens(response),
         "createdAt": datetime.utcnow()
     }
     
     # Update chat title if this is the first message
     update_data = {
-        "$push": {"messages": {"$each": [user_message, ai_message]}},
         "$set": {"updatedAt": datetime.utcnow()}
     }
     
-    if len(chat["messages"]) == 0 and "session_index" not in chat:
+    if chat.get("message_count", 0) == 0 and "session_index" not in chat:
         # This should not typically happen since session_index is set at creation,
         # but as a fallback, we can set it here
-        latest_chat = conversations.find_one(
-            {"userId": ObjectId(userId), "_id": {"$ne": ObjectId(chat_id)}},
-            sort=[("session_index", -1)]
-        )
-        next_session_index = (latest_chat["session_index"] + 1) if latest_chat and "session_index" in latest_chat else 1
-        update_data["$set"]["title"] = f"Session {next_session_index}"
-        update_data["$set"]["session_index"] = next_session_index
-    
-    conversations.update_one(
-        {"_id": ObjectId(chat_id)},
-        update_data
-    )
+        session_index = await next_session_index(userId)
+        update_data["$set"]["title"] = f"Session {session_index}"
+        update_data["$set"]["session_index"] = session_index
+    
+    await append_messages(chat_id, [user_message, ai_message], update_data)
+    schedule_summary_update(chat_id)
+
+def _check_filters(filters):
+    try:
+        validate_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+@chats_router.post("/{chat_id}/message_send", response_class=JSONResponse)
+async def send_chat_message(userId: str, chat_id: str, request: ChatMessageRequest):
+    chat = await _load_chat_for_message(userId, chat_id)
+    _check_filters(request.filters)
+    agent = await _build_agent(userId, chat)
+    
+    # Get response and original user message
+    response, original_user_message = await agent.achat(request.message, request.filters)
+    await _store_turn(userId, chat_id, chat, original_user_message, response)
     
     return {
         "role": "assistant",
         "content": response,
-        "chat_id": chat_id
+        "chat_id": chat_id,
+        "dropped_turns": agent.dropped_turns
     }
 
+@chats_router.post("/{chat_id}/message_stream")
+async def stream_chat_message(http_request: Request, userId: str, chat_id: str, request: ChatMessageRequest):
+    """Stream the assistant reply as Server-Sent Events.
+
+    Each `data:` event carries a `{"delta": ...}` fragment; a final `done` event follows once
+    the full reply has been stored. If the client disconnects mid-stream, the upstream LLM
+    stream is closed and the partial turn is not persisted.
+    """
+    chat = await _load_chat_for_message(userId, chat_id)
+    _check_filters(request.filters)
+    agent = await _build_agent(userId, chat)
+
+    async def event_stream():
+        deltas = agent.astream_chat(request.message, request.filters)
+        response = ""
+        completed = False
+        try:
+            async for delta in deltas:
+                if await http_request.is_disconnected():
+                    break
+                response += delta
+                yield _sse_event({"delta": delta})
+            else:
+                completed = True
+        except Exception as e:
+            yield _sse_event({"error": f"I encountered an error: {str(e)}. Please try again."}, event="error")
+        finally:
+            await deltas.aclose()
+
+        if completed:
+            await _store_turn(userId, chat_id, chat, request.message, response)
+            yield _sse_event({"role": "assistant", "chat_id": chat_id, "dropped_turns": agent.dropped_turns}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @chats_router.delete("/{chat_id}", response_class=JSONResponse)
 async def delete_chat(userId: str, chat_id: str):
     if not userId or userId.strip() == "":
         raise HTTPException(status_code=400, detail="User ID is required")
-    result = conversations.delete_one({
+    result = await conversations.delete_one({
         "_id": ObjectId(chat_id),
         "userId": ObjectId(userId)
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Chat not found")
+    await delete_chat_messages(chat_id)
     return {"message": "Chat deleted successfully"}
\ No newline at end of file
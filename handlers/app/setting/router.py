@@ -12,7 +12,7 @@ views = Jinja2Templates(directory="views")
 @settings_router.get("", response_class=HTMLResponse)
 async def settings_page(request: Request, userId: str):
     # Verify user exists
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
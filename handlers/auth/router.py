@@ -3,6 +3,7 @@ from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 from core.database import user_collection
 from datetime import datetime
 import hashlib
@@ -38,7 +39,7 @@ async def login_page(request: Request):
 
 @auth_router.post("/login", response_class=HTMLResponse)
 async def login(request: Request, email: str = Form(...), password: str = Form(...)):
-    user = user_collection.find_one({"email": email})
+    user = await user_collection.find_one({"email": email})
     if not user or user["password"] != hash_password(password):
         return views.TemplateResponse(
             request=request,
@@ -68,7 +69,7 @@ async def signup(request: Request, name: str = Form(...), email: str = Form(...)
             context={"error": "Password is required"}
         )
     
-    if user_collection.find_one({"email": email}):
+    if await user_collection.find_one({"email": email}):
         return views.TemplateResponse(
             request=request,
             name="auth/signup.html",
@@ -82,7 +83,15 @@ async def signup(request: Request, name: str = Form(...), email: str = Form(...)
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow()
     }
-    result = user_collection.insert_one(user_data)
+    try:
+        result = await user_collection.insert_one(user_data)
+    except DuplicateKeyError:
+        # A concurrent signup took the email between the check and the insert (unique index on email)
+        return views.TemplateResponse(
+            request=request,
+            name="auth/signup.html",
+            context={"error": "Email already registered"}
+        )
     user_id = str(result.inserted_id)
     if not user_id:
         raise HTTPException(status_code=500, detail="Failed to create user")
@@ -94,14 +103,14 @@ async def logout():
 
 @auth_router.get("/settings/{userId}", response_class=JSONResponse)
 async def get_settings(userId: str):
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"name": user["name"]}
 
 @auth_router.post("/settings/{userId}", response_class=RedirectResponse)
 async def update_settings(userId: str, old_password: str = Form(...), name: str = Form(...), password: str = Form(default="")):
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -115,7 +124,7 @@ async def update_settings(userId: str, old_password: str = Form(...), name: str
     if password:
         update_data["password"] = hash_password(password)
     
-    user_collection.update_one(
+    await user_collection.update_one(
         {"_id": ObjectId(userId)},
         {"$set": update_data}
     )
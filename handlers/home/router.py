@@ -12,7 +12,7 @@ views = Jinja2Templates(directory="views")
 @home_router.get("/{userId}", response_class=HTMLResponse)
 async def homepage(request: Request, userId: str):
     # Verify user exists
-    user = user_collection.find_one({"_id": ObjectId(userId)})
+    user = await user_collection.find_one({"_id": ObjectId(userId)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -7,9 +7,39 @@ from handlers.auth.router import auth_router
 from handlers.app.setting.router import settings_router
 from dotenv import load_dotenv
 from fastapi.responses import RedirectResponse
+from core.database import client as mongo_client
+from core.executor import run_blocking, shutdown_executor
+from core.clients import init_registry, get_registry, close_registry
+from core.semantic_cache import semantic_cache_stats
+from core.db_indexes import bootstrap_indexes, index_status
+from utils.code_files.retriever import get_runtime, retrieval_stats
+from utils.code_files.embedding_cache import get_embedding_cache
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Keeps the warm-up task referenced so it is not garbage-collected mid-load
+_warmup_task = None
+
+def _log_warmup_result(task: asyncio.Task):
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error("Retrieval runtime warm-up failed; the first query will retry the load",
+                     exc_info=(type(error), error, error.__traceback__))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/assets", StaticFiles(directory="assets"), name="assets")
 
@@ -41,6 +71,33 @@ app.include_router(
     tags=["Home"]
 )
 
+async def startup():
+    init_registry()
+    try:
+        await bootstrap_indexes()  # Logs missing indexes and creation failures itself
+    except Exception:
+        logger.exception("MongoDB index check failed")
+    # Load the retrieval runtime in the background so the first chat turn does not pay for it
+    global _warmup_task
+    if os.getenv("RETRIEVAL_WARMUP", "1") == "1":
+        _warmup_task = asyncio.create_task(run_blocking(get_runtime))
+        _warmup_task.add_done_callback(_log_warmup_result)
+
+async def shutdown():
+    await close_registry()
+    await mongo_client.close()
+    shutdown_executor()
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "http_clients": get_registry().stats(),
+        "semantic_cache": semantic_cache_stats(),
+        "retrieval": retrieval_stats(),
+        "embedding_cache": get_embedding_cache().stats(),
+        "database_indexes": index_status()
+    }
+
 @app.get("/")
 async def root():
     return RedirectResponse(url="/auth", status_code=303)
@@ -1,48 +1,169 @@
 import os
+import time
+import shutil
+import hashlib
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from typing import List
+from typing import List, Optional, Tuple
 import tiktoken
 from tenacity import retry, stop_after_attempt, wait_exponential
 from langchain_community.embeddings import JinaEmbeddings
 
+try:
+    from utils.code_files.embedding_cache import get_embedding_cache
+except ImportError:  # run as a script from utils/code_files
+    from embedding_cache import get_embedding_cache
+
 # Load from env
 EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'jina-embeddings-v3')
 JINA_API_KEY = os.getenv("JINA_API_KEY")
+# Batches in flight at once, and the token budget that sizes each batch
+JINA_EMBED_CONCURRENCY = int(os.getenv("JINA_EMBED_CONCURRENCY", "4"))
+JINA_BATCH_MAX_TOKENS = int(os.getenv("JINA_BATCH_MAX_TOKENS", "60000"))
+# Finished batches are written here so an interrupted index build resumes where it stopped
+_app_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+JINA_EMBED_CHECKPOINT_DIR = os.getenv("JINA_EMBED_CHECKPOINT_DIR", os.path.join(_app_dir, ".embedding_checkpoints"))
+MAX_TEXT_TOKENS = 2048
 
 # Tokenizer (cl100k_base is used for OpenAI/Jina-compatible models)
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
-def clip_text_to_tokens(text: str, max_tokens: int = 2048) -> str:
-    tokens = tokenizer.encode(text)
+def clip_text_to_tokens(text: str, max_tokens: int = MAX_TEXT_TOKENS) -> str:
+    # Special-token markup in user text (e.g. "<|endoftext|>") is encoded as plain text rather than rejected
+    tokens = tokenizer.encode(text, disallowed_special=())
     return tokenizer.decode(tokens[:max_tokens])
 
+def clip_texts_to_tokens(texts: List[str], max_tokens: int = MAX_TEXT_TOKENS) -> Tuple[List[str], List[int]]:
+    """Batched clipping; returns the clipped texts and their token counts.
+
+    Texts already within the limit are returned unchanged, so only long ones are decoded.
+    """
+    encoded = tokenizer.encode_batch(texts, disallowed_special=())
+    long_rows = [i for i, tokens in enumerate(encoded) if len(tokens) > max_tokens]
+    clipped = list(texts)
+    for i, text in zip(long_rows, tokenizer.decode_batch([encoded[i][:max_tokens] for i in long_rows])):
+        clipped[i] = text
+    return clipped, [min(len(tokens), max_tokens) for tokens in encoded]
+
+def plan_batches(token_counts: List[int], max_batch_size: int, max_batch_tokens: int) -> List[Tuple[int, int]]:
+    """Split rows into consecutive [start, end) batches bounded by both size and total tokens."""
+    batches = []
+    start, tokens = 0, 0
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_batch_size or tokens + count > max_batch_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
 class JinaEmbeddingWrapper:
     """
     Wrapper for Jina Embeddings v3 via LangChain with:
-    - Batch processing
+    - Token-budgeted batches sent concurrently
     - Token-safe truncation (2048 tokens max)
-    - Retry logic
+    - Per-batch retry with exponential backoff
+    - On-disk checkpoints so an interrupted run only embeds the missing batches
+    - Persistent query-embedding cache shared with the retriever
     """
 
-    def __init__(self, api_key: str = None, batch_size: int = 500):
+    def __init__(self, api_key: str = None, batch_size: int = 500, concurrency: int = JINA_EMBED_CONCURRENCY,
+                 max_batch_tokens: int = JINA_BATCH_MAX_TOKENS, checkpoint_dir: Optional[str] = JINA_EMBED_CHECKPOINT_DIR,
+                 model_name: str = None):
         self.api_key = api_key or JINA_API_KEY
+        # Callers pass the model their queries use; the env default is read at import, before any .env is loaded
+        self.model_name = model_name or EMBEDDINGS_MODEL
         self.batch_size = min(batch_size, 2048)  # Hard limit
+        self.concurrency = max(1, concurrency)
+        self.max_batch_tokens = max_batch_tokens
+        self.checkpoint_dir = checkpoint_dir
+        self.last_stats = {}
         self.model = JinaEmbeddings(
             jina_api_key=self.api_key,
-            model_name=EMBEDDINGS_MODEL,
+            model_name=self.model_name,
         )
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=2, max=30), reraise=True)
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.embed_documents(texts), dtype=np.float32)
+
+    def _run_dir(self, texts: List[str], batches: List[Tuple[int, int]]) -> Optional[str]:
+        """Checkpoint folder for this exact input and batch plan."""
+        if not self.checkpoint_dir:
+            return None
+        digest = hashlib.sha256(self.model_name.encode("utf-8"))
+        for text in texts:
+            digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+        digest.update(repr(batches).encode("utf-8"))
+        return os.path.join(self.checkpoint_dir, digest.hexdigest()[:24])
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one small batch as a single request: clipped and retried, but no checkpoints,
+        thread pool or progress output. For streaming callers that schedule batches themselves."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        clipped, _ = clip_texts_to_tokens(texts)
+        return self._embed_batch(clipped)
+
     def embed_documents(self, texts: List[str]) -> np.ndarray:
         """Embed a list of documents safely in batches"""
-        embeddings = []
-        for i in tqdm(range(0, len(texts), self.batch_size), desc="Embedding"):
-            batch = texts[i:i + self.batch_size]
-            batch_clipped = [clip_text_to_tokens(t) for t in batch]
-            batch_embeddings = self.model.embed_documents(batch_clipped)
-            embeddings.extend(batch_embeddings)
-        return np.array(embeddings)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        start_time = time.perf_counter()
+        clipped, token_counts = clip_texts_to_tokens(texts)
+        batches = plan_batches(token_counts, self.batch_size, self.max_batch_tokens)
+        run_dir = self._run_dir(clipped, batches)
+
+        results = {}
+        if run_dir:
+            os.makedirs(run_dir, exist_ok=True)
+            for start, end in batches:
+                path = os.path.join(run_dir, f"{start:08d}.npy")
+                if os.path.exists(path):
+                    results[start] = np.load(path)
+            if results:
+                print(f"[INFO] Resuming embedding run: {len(results)}/{len(batches)} batches already done")
+
+        def embed_and_checkpoint(start: int, end: int) -> np.ndarray:
+            vectors = self._embed_batch(clipped[start:end])
+            if run_dir:
+                # Saved as soon as the batch lands (write then rename), so a failure elsewhere loses nothing
+                path = os.path.join(run_dir, f"{start:08d}.npy")
+                np.save(path + ".tmp.npy", vectors)
+                os.replace(path + ".tmp.npy", path)
+            return vectors
+
+        todo = [(start, end) for start, end in batches if start not in results]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(embed_and_checkpoint, start, end): start for start, end in todo}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Embedding"):
+                results[futures[future]] = future.result()
+
+        embeddings = np.concatenate([results[start] for start, _ in batches])
+        if run_dir:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+        elapsed = time.perf_counter() - start_time
+        embedded = sum(end - start for start, end in todo)
+        self.last_stats = {
+            "vectors": len(texts),
+            "embedded": embedded,
+            "batches": len(batches),
+            "seconds": round(elapsed, 2),
+            "vectors_per_s": round(embedded / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        print(f"[INFO] Embedded {embedded} texts in {len(todo)} batches "
+              f"({self.last_stats['vectors_per_s']} vectors/s, concurrency {self.concurrency})")
+        return embeddings
 
     def embed_query(self, query: str) -> List[float]:
-        return self.model.embed_query(clip_text_to_tokens(query))
+        clipped = clip_text_to_tokens(query)
+        cache = get_embedding_cache()
+        vector = cache.get(self.model_name, clipped)
+        if vector is not None:
+            return vector.tolist()
+        vector = self.model.embed_query(clipped)
+        cache.put(self.model_name, clipped, vector)
+        return vector
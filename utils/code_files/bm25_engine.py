@@ -0,0 +1,174 @@
+import os
+import re
+import json
+from typing import Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+from langchain.schema import Document
+
+# Small English stopword list; clinical terms are deliberately kept
+DEFAULT_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can did do does doing down during each few for from further had has have having he her here
+hers herself him himself his how i if in into is it its itself just me more most my myself no nor not of
+off on once only or other our ours ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too under until up very was we were what
+when where which while who whom why will with you your yours yourself yourselves
+""".split())
+
+class BM25Tokenizer:
+    """Configurable tokenizer: word regex, optional lowercasing, stopword removal and Porter stemming."""
+
+    def __init__(self, lowercase: bool = True, stopwords: Optional[Iterable[str]] = DEFAULT_STOPWORDS, stem: bool = False):
+        self.lowercase = lowercase
+        self.stopwords = frozenset(stopwords or ())
+        self.stem = stem
+        self._stemmer = None
+        if stem:
+            from nltk.stem import PorterStemmer
+            self._stemmer = PorterStemmer()
+
+    def __call__(self, text: str) -> List[str]:
+        if self.lowercase:
+            text = text.lower()
+        tokens = [t for t in re.findall(r"\w+", text) if t not in self.stopwords]
+        if self._stemmer is not None:
+            tokens = [self._stemmer.stem(t) for t in tokens]
+        return tokens
+
+    def config(self) -> dict:
+        return {"lowercase": self.lowercase, "stopwords": sorted(self.stopwords), "stem": self.stem}
+
+class SparseBM25:
+    """BM25 over a precomputed CSR term-document matrix of per-term BM25 weights.
+
+    Row t of `weights` holds idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) for every
+    document containing t, so a query is scored by summing a handful of sparse rows and the
+    top k is taken with `argpartition`. idf uses the non-negative log(1 + (N - n + 0.5) / (n + 0.5)).
+
+    `invoke` reports a calibrated `sparse_score` in [0, 1]: the raw score divided by what an
+    average-length document containing every query term exactly once would score (each term then
+    contributes its idf). 1.0 means "all query terms present"; a document holding only half of
+    the query's idf mass scores about 0.5. Repeated terms or short documents can exceed the
+    reference and are clipped to 1.0.
+    """
+
+    def __init__(self, weights: sparse.csr_matrix, vocabulary: dict, documents: Sequence[Document],
+                 idf: np.ndarray, k1: float = 1.5, tokenizer: BM25Tokenizer = None, k: int = 5):
+        self.weights = weights
+        self.vocabulary = vocabulary
+        self.documents = documents
+        self.idf = idf
+        self.k1 = k1
+        self.tokenizer = tokenizer or BM25Tokenizer()
+        self.k = k
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], documents: Sequence[Document] = None, tokenizer: BM25Tokenizer = None,
+                   k1: float = 1.5, b: float = 0.75, k: int = 5) -> "SparseBM25":
+        tokenizer = tokenizer or BM25Tokenizer()
+        vocabulary = {}
+        rows, cols, counts = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenizer(text)
+            doc_lengths[doc_id] = len(tokens)
+            term_ids = np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in tokens), dtype=np.int64, count=len(tokens))
+            if not len(term_ids):
+                continue
+            unique, tf = np.unique(term_ids, return_counts=True)
+            rows.append(unique)
+            cols.append(np.full(len(unique), doc_id, dtype=np.int64))
+            counts.append(tf)
+
+        n_docs, n_terms = len(texts), len(vocabulary)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        tf = np.concatenate(counts).astype(np.float32) if counts else np.zeros(0, dtype=np.float32)
+
+        avgdl = doc_lengths.mean() if n_docs else 0.0
+        doc_freq = np.bincount(rows, minlength=n_terms).astype(np.float32)
+        idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1 - b + b * doc_lengths[cols] / (avgdl or 1.0))
+        data = idf[rows] * tf * (k1 + 1) / (tf + norm)
+
+        weights = sparse.csr_matrix((data.astype(np.float32), (rows, cols)), shape=(n_terms, n_docs))
+        return cls(weights, vocabulary, documents, idf.astype(np.float32), k1=k1, tokenizer=tokenizer, k=k)
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document], **kwargs) -> "SparseBM25":
+        return cls.from_texts([doc.page_content for doc in documents], documents=documents, **kwargs)
+
+    def _query_terms(self, query: str):
+        term_ids = [self.vocabulary[t] for t in self.tokenizer(query) if t in self.vocabulary]
+        return np.unique(term_ids, return_counts=True) if term_ids else (None, None)
+
+    def reference_score(self, query: str) -> float:
+        """BM25 score of an average-length document containing each query term once (the sum of idfs).
+
+        Terms no document contains count at the largest possible idf, so a query whose rarest
+        words are missing from the corpus cannot score a chunk as fully relevant.
+        """
+        tokens = self.tokenizer(query)
+        unique, query_tf = self._query_terms(query)
+        known = float((self.idf[unique] * query_tf).sum()) if unique is not None else 0.0
+        unknown = sum(1 for t in tokens if t not in self.vocabulary)
+        n_docs = self.weights.shape[1]
+        return known + unknown * float(np.log1p((n_docs + 0.5) / 0.5))
+
+    def search(self, query: str, k: int = None, allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return up to k (document index, score) pairs with positive score, best first.
+
+        `allowed_ids` restricts scoring to those documents (metadata pre-filtering).
+        """
+        k = k or self.k
+        unique, query_tf = self._query_terms(query)
+        if unique is None:
+            return []
+        scores = np.asarray(self.weights[unique].T @ query_tf.astype(np.float32)).ravel()
+
+        if allowed_ids is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[allowed_ids] = True
+            scores = np.where(mask, scores, 0.0)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        candidates = candidates[np.argsort(scores[candidates])[::-1]]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+    def invoke(self, query: str, allowed_ids: Optional[np.ndarray] = None, **kwargs) -> List[Document]:
+        """Top-k documents (copies) with a calibrated `sparse_score` in their metadata."""
+        hits = self.search(query, allowed_ids=allowed_ids)
+        reference = self.reference_score(query) or 1.0
+        return [self._document(i, sparse_score=min(score / reference, 1.0)) for i, score in hits]
+
+    def _document(self, row: int, **extra_metadata) -> Document:
+        # A ChunkTable builds the view directly, decoding the row's text once
+        if hasattr(self.documents, "document"):
+            return self.documents.document(row, **extra_metadata)
+        doc = self.documents[row]
+        return Document(page_content=doc.page_content, metadata={**doc.metadata, **extra_metadata})
+
+    # === Serialization ===
+    def save(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        sparse.save_npz(os.path.join(folder, "bm25_weights.npz"), self.weights)
+        np.save(os.path.join(folder, "bm25_idf.npy"), self.idf)
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        with open(os.path.join(folder, "bm25_vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({"terms": terms, "tokenizer": self.tokenizer.config(), "k": self.k, "k1": self.k1}, f)
+
+    @classmethod
+    def load(cls, folder: str, documents: Sequence[Document]) -> "SparseBM25":
+        weights = sparse.load_npz(os.path.join(folder, "bm25_weights.npz")).tocsr()
+        with open(os.path.join(folder, "bm25_vocab.json"), encoding="utf-8") as f:
+            saved = json.load(f)
+        if weights.shape[1] != len(documents):
+            raise ValueError(f"BM25 index covers {weights.shape[1]} documents but {len(documents)} were provided.")
+        vocabulary = {term: i for i, term in enumerate(saved["terms"])}
+        idf = np.load(os.path.join(folder, "bm25_idf.npy"))
+        return cls(weights, vocabulary, documents, idf, k1=saved["k1"],
+                   tokenizer=BM25Tokenizer(**saved["tokenizer"]), k=saved["k"])
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+from datetime import datetime, timezone
+import faiss
+
+try:
+    from utils.code_files.chunk_store import ChunkTable
+    from utils.code_files.bm25_engine import SparseBM25, BM25Tokenizer
+except ImportError:  # run as a script from utils/code_files
+    from chunk_store import ChunkTable
+    from bm25_engine import SparseBM25, BM25Tokenizer
+
+# Bump when the on-disk layout changes; older bundles are then ignored
+BUNDLE_FORMAT_VERSION = 3
+MANIFEST_FILE = "manifest.json"
+BUNDLE_INDEX_FILE = "index.faiss"
+# Each save goes to versions/<id>; CURRENT names the live one and is replaced atomically, so
+# workers that memory-mapped an earlier version keep reading intact files
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+def chunks_from_faiss_store(faiss_store) -> ChunkTable:
+    """Chunk table in FAISS id order, so a FAISS id is also the chunk row id."""
+    documents = [
+        faiss_store.docstore.search(faiss_store.index_to_docstore_id[i])
+        for i in range(faiss_store.index.ntotal)
+    ]
+    return ChunkTable.from_documents(documents)
+
+def switch_current(folder: str, version: str):
+    """Point `folder`'s CURRENT file at `version` in one atomic rename."""
+    pointer = os.path.join(folder, f"{CURRENT_FILE}.{version}.tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(folder, CURRENT_FILE))
+
+def current_bundle_version(folder: str):
+    """Id of the live bundle version in `folder`, or None for a bundle written before versioning."""
+    try:
+        with open(os.path.join(folder, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def bundle_version_dir(folder: str, version=None) -> str:
+    """Directory holding `version` of the bundle; unversioned bundles live in `folder` itself."""
+    return os.path.join(folder, VERSIONS_DIR, version) if version else folder
+
+def live_bundle_dir(folder: str) -> str:
+    return bundle_version_dir(folder, current_bundle_version(folder))
+
+def save_bundle(folder: str, index, chunks: ChunkTable, bm25: SparseBM25, index_info: dict, embeddings_model: str) -> dict:
+    """Write the bundle to a new version directory, then switch CURRENT to it.
+
+    Files of the previous version are never rewritten in place, so live workers that have them
+    memory-mapped are unaffected until they reload. That version is kept for readers that
+    resolved CURRENT just before the switch; older ones are removed.
+    """
+    previous = current_bundle_version(folder)
+    version = uuid.uuid4().hex
+    version_dir = bundle_version_dir(folder, version)
+    os.makedirs(version_dir)
+
+    faiss.write_index(index, os.path.join(version_dir, BUNDLE_INDEX_FILE))
+    chunks.save(version_dir)
+    bm25.save(version_dir)
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "bundle_id": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "embeddings_model": embeddings_model,
+        "chunks": len(chunks),
+        "index_info": index_info,
+    }
+    with open(os.path.join(version_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    switch_current(folder, version)
+
+    for old in os.listdir(os.path.join(folder, VERSIONS_DIR)):
+        if old not in (version, previous):
+            # Still-mapped files cannot be deleted on Windows; they go on a later save
+            shutil.rmtree(bundle_version_dir(folder, old), ignore_errors=True)
+    return manifest
+
+def read_manifest(folder: str):
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        return None
+    return manifest
+
+def read_bundle_index(path: str, use_mmap: bool = True):
+    """Read the FAISS index, memory-mapping its vectors so worker processes share the pages."""
+    if use_mmap:
+        # IO_FLAG_MMAP_IFC (newer faiss) maps flat/HNSW vector storage in place; older builds only have IO_FLAG_MMAP
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            # Older faiss builds cannot map every index type
+            print(f"[WARN] Memory-mapped FAISS load failed ({e}); reading index into memory")
+    return faiss.read_index(path)
+
+def load_bundle(folder: str, use_mmap: bool = True):
+    """Load (manifest, index, chunks, bm25) and per-stage load timings from one bundle version directory.
+
+    With `use_mmap` the index vectors and chunk text stay in the page cache instead of
+    being copied into each process.
+    """
+    timings = {}
+    start = time.perf_counter()
+    manifest = read_manifest(folder)
+    if manifest is None:
+        raise FileNotFoundError(f"No compatible retrieval bundle in {folder}")
+
+    index = read_bundle_index(os.path.join(folder, BUNDLE_INDEX_FILE), use_mmap)
+    timings["index_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = ChunkTable.load(folder, use_mmap)
+    timings["chunks_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bm25 = SparseBM25.load(folder, chunks)
+    timings["bm25_s"] = time.perf_counter() - start
+    return manifest, index, chunks, bm25, timings
+
+def bundle_artifact_paths(folder: str):
+    return [os.path.join(folder, MANIFEST_FILE)]
+
+# === Compile from the FAISS artifact written by vector_store.py ===
+if __name__ == "__main__":
+    from retriever import (
+        RETRIEVAL_BUNDLE_PATH, BM25_STEMMING, embedding_backend, load_faiss_store
+    )
+
+    parser = argparse.ArgumentParser(description="Compile the retrieval bundle for fast cold starts.")
+    parser.add_argument("--out", default=RETRIEVAL_BUNDLE_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    faiss_store, index_info = load_faiss_store()
+    chunks = chunks_from_faiss_store(faiss_store)
+    bm25 = SparseBM25.from_texts(chunks.texts, documents=chunks, tokenizer=BM25Tokenizer(stem=BM25_STEMMING), k=5)
+    manifest = save_bundle(args.out, faiss_store.index, chunks, bm25, index_info, embedding_backend.model_name)
+    print(f"Compiled bundle {manifest['bundle_id']} ({manifest['chunks']} chunks) to {args.out} "
+          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,196 @@
+import os
+import json
+import math
+import mmap
+from array import array
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from langchain.schema import Document
+
+# Chunk metadata kept alongside the text, in the order written by file_upload_chunks/vector_store
+CHUNK_COLUMNS = ("chunk_id", "section_title", "topic", "book_name", "book_type", "page_number", "also_pages")
+
+# Interned metadata: per-column int32 codes plus the shared table of distinct values
+CHUNK_CODES_FILE = "chunk_codes.npz"
+CHUNK_VALUES_FILE = "chunk_values.json"
+# Chunk text as one UTF-8 blob plus row offsets, so it can be memory-mapped and shared across workers
+CHUNK_TEXT_FILE = "chunk_text.bin"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+
+def _clean(value):
+    # pandas hands back NaN for empty cells; keep the table JSON-friendly
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+class MappedTexts(Sequence):
+    """Read-only list of chunk texts backed by a memory-mapped UTF-8 file.
+
+    Pages come from the OS page cache, so every worker on a host shares one physical copy;
+    a text is only decoded when a row is actually read.
+    """
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.offsets = offsets
+        with open(path, "rb") as f:
+            # mmap refuses empty files; an empty corpus has nothing to map anyway
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self._data[start:end].decode("utf-8")
+
+class _ValueTable:
+    """Assigns each distinct metadata value a stable int code."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value) -> int:
+        value = _clean(value)
+        if value is None:
+            return -1
+        key = (type(value), value)
+        if key not in self._codes:
+            self._codes[key] = len(self.values)
+            self.values.append(value)
+        return self._codes[key]
+
+class ChunkTable:
+    """The chunk corpus as parallel columns, addressed by integer row id.
+
+    Row ids are shared by the dense index (FAISS id == row) and the BM25 matrix, so retrievers
+    only pass integers around and build a `Document` for the rows they return. Metadata is
+    interned: each column is an int32 array of codes into one shared `values` table, so a topic
+    or book name is stored once however many chunks carry it (code -1 means missing).
+    """
+
+    def __init__(self, texts: Sequence[str], codes: Dict[str, np.ndarray], values: List):
+        self.texts = texts
+        self.codes = codes
+        self.values = values
+        chunk_ids = codes["chunk_id"]
+        self._row_by_chunk_id = {values[code]: row for row, code in enumerate(chunk_ids.tolist()) if code >= 0}
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document]) -> "ChunkTable":
+        texts = [doc.page_content for doc in documents]
+        table = _ValueTable()
+        codes = {
+            name: np.fromiter((table.code(doc.metadata.get(name)) for doc in documents), dtype=np.int32, count=len(documents))
+            for name in CHUNK_COLUMNS
+        }
+        return cls(texts, codes, table.values)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def value(self, name: str, row: int):
+        code = self.codes[name][row]
+        return None if code < 0 else self.values[code]
+
+    def metadata(self, row: int) -> dict:
+        return {name: self.value(name, row) for name in CHUNK_COLUMNS}
+
+    def groups(self, name: str) -> Dict:
+        """Each distinct value of a column mapped to the sorted row ids that carry it."""
+        column = self.codes[name]
+        order = np.argsort(column, kind="stable")
+        distinct, starts = np.unique(column[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        return {
+            self.values[code]: order[bounds[i]:bounds[i + 1]].astype(np.int64)
+            for i, code in enumerate(distinct.tolist()) if code >= 0
+        }
+
+    def document(self, row: int, **extra_metadata) -> Document:
+        """A `Document` view of one row; extra metadata (scores) is merged in."""
+        return Document(page_content=self.texts[row], metadata={**self.metadata(row), **extra_metadata})
+
+    def __getitem__(self, row: int) -> Document:
+        return self.document(row)
+
+    def row_for_chunk_id(self, chunk_id: str) -> Optional[int]:
+        return self._row_by_chunk_id.get(chunk_id)
+
+    def document_by_chunk_id(self, chunk_id: str) -> Optional[Document]:
+        row = self._row_by_chunk_id.get(chunk_id)
+        return None if row is None else self.document(row)
+
+    def save(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        offsets = np.zeros(len(self.texts) + 1, dtype=np.int64)
+        with open(os.path.join(folder, CHUNK_TEXT_FILE), "wb") as f:
+            for row, text in enumerate(self.texts):
+                encoded = text.encode("utf-8")
+                f.write(encoded)
+                offsets[row + 1] = offsets[row] + len(encoded)
+        np.save(os.path.join(folder, CHUNK_OFFSETS_FILE), offsets)
+        np.savez(os.path.join(folder, CHUNK_CODES_FILE), **self.codes)
+        with open(os.path.join(folder, CHUNK_VALUES_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, folder: str, use_mmap: bool = True) -> "ChunkTable":
+        with open(os.path.join(folder, CHUNK_VALUES_FILE), encoding="utf-8") as f:
+            values = json.load(f)
+        with np.load(os.path.join(folder, CHUNK_CODES_FILE)) as saved:
+            rows = len(saved["chunk_id"])
+            # Columns added after a table was written read back as missing
+            codes = {name: saved[name] if name in saved else np.full(rows, -1, dtype=np.int32) for name in CHUNK_COLUMNS}
+        text_path = os.path.join(folder, CHUNK_TEXT_FILE)
+        offsets = np.load(os.path.join(folder, CHUNK_OFFSETS_FILE), mmap_mode="r" if use_mmap else None)
+        texts = MappedTexts(text_path, offsets)
+        if not use_mmap:
+            texts = list(texts)
+        return cls(texts, codes, values)
+
+class ChunkTableWriter:
+    """Writes a `ChunkTable` to `folder` incrementally, for corpora streamed from ingestion.
+
+    Text goes straight to disk; only offsets and metadata codes (a few bytes per chunk) stay in memory.
+    """
+
+    def __init__(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self._text_file = open(os.path.join(folder, CHUNK_TEXT_FILE), "wb")
+        self._offsets = array("q", [0])
+        self._table = _ValueTable()
+        self._codes = {name: array("i") for name in CHUNK_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, chunk: dict):
+        """Add one chunk dict with "text" plus the CHUNK_COLUMNS metadata."""
+        encoded = chunk["text"].encode("utf-8")
+        self._text_file.write(encoded)
+        self._offsets.append(self._offsets[-1] + len(encoded))
+        for name in CHUNK_COLUMNS:
+            self._codes[name].append(self._table.code(chunk.get(name)))
+
+    def close(self, use_mmap: bool = True, updates: Optional[Dict[str, dict]] = None) -> ChunkTable:
+        """Finish the table; `updates` maps chunk_id -> column values learned after the chunk was appended."""
+        self._text_file.close()
+        if updates:
+            chunk_ids = self._codes["chunk_id"]
+            for row in range(len(self)):
+                code = chunk_ids[row]
+                changes = updates.get(self._table.values[code]) if code >= 0 else None
+                for name, value in (changes or {}).items():
+                    self._codes[name][row] = self._table.code(value)
+        np.save(os.path.join(self.folder, CHUNK_OFFSETS_FILE), np.frombuffer(self._offsets, dtype=np.int64))
+        np.savez(os.path.join(self.folder, CHUNK_CODES_FILE),
+                 **{name: np.frombuffer(codes, dtype=np.int32) for name, codes in self._codes.items()})
+        with open(os.path.join(self.folder, CHUNK_VALUES_FILE), "w", encoding="utf-8") as f:
+            json.dump(self._table.values, f, ensure_ascii=False)
+        return ChunkTable.load(self.folder, use_mmap)
@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+# Chunks at least this similar (Jaccard over word shingles) collapse into the first one seen; 0 disables
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))
+MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+SHINGLE_SIZE = 3
+# Dropped chunk_id -> surviving chunk_id, written next to an ingested bundle for auditing
+DUPLICATES_FILE = "chunk_duplicates.json"
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; with p < 2^32, a * x + b fits in uint64
+_PRIME = np.uint64(4294967291)  # Largest prime below 2^32
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Distinct 32-bit hashes of the word n-grams of a normalised text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve midpoint (1/b)^(1/r) lies closest to the threshold."""
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(options, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - threshold))
+
+class NearDuplicateFilter:
+    """Streaming MinHash/LSH near-duplicate detector.
+
+    Each text gets a `num_perm` MinHash signature; signatures are split into LSH bands so only
+    texts sharing a band bucket are compared. A text whose estimated Jaccard similarity to an
+    earlier survivor reaches `threshold` is reported as a duplicate of it. Memory is one
+    signature per surviving chunk.
+    """
+
+    def __init__(self, threshold: float = CHUNK_DEDUP_THRESHOLD, num_perm: int = MINHASH_PERMUTATIONS, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._signatures: List[np.ndarray] = []
+        self._ids: List[str] = []
+        self.duplicate_of: Dict[str, str] = {}
+        self._pages: Dict[str, list] = {}  # survivor chunk_id -> [own page, pages of its duplicates...]
+        self.seen = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def check(self, chunk_id: str, text: str) -> Optional[str]:
+        """Id of the earlier chunk this one duplicates, or None (and remember it as a survivor)."""
+        self.seen += 1
+        signature = self.signature(text)
+        keys = self._band_keys(signature)
+        candidates = {row for band, key in enumerate(keys) for row in self._buckets[band].get(key, ())}
+        if candidates:
+            rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarity = (np.stack([self._signatures[r] for r in rows]) == signature).mean(axis=1)
+            best = int(np.argmax(similarity))
+            if similarity[best] >= self.threshold:
+                survivor = self._ids[rows[best]]
+                self.duplicate_of[chunk_id] = survivor
+                return survivor
+
+        row = len(self._ids)
+        self._ids.append(chunk_id)
+        self._signatures.append(signature)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(row)
+        return None
+
+    def iter_unique(self, chunks: Iterable[dict]) -> Iterator[dict]:
+        """Pass through chunks that are not near-duplicates of an earlier one."""
+        for chunk in chunks:
+            survivor = self.check(chunk["chunk_id"], chunk["text"])
+            if survivor is None:
+                self._pages[chunk["chunk_id"]] = [chunk.get("page_number")]
+                yield chunk
+            else:
+                self._pages[survivor].append(chunk.get("page_number"))
+
+    def also_pages(self) -> Dict[str, str]:
+        """Survivor chunk_id -> the other pages its dropped duplicates appeared on, e.g. "178, 205"."""
+        extra = {}
+        for chunk_id, (own, *others) in self._pages.items():
+            pages = sorted({int(p) for p in others if p is not None and p == p and p != own})
+            if pages:
+                extra[chunk_id] = ", ".join(str(p) for p in pages)
+        return extra
+
+    def report(self) -> dict:
+        dropped = len(self.duplicate_of)
+        return {
+            "chunks": self.seen,
+            "kept": self.seen - dropped,
+            "dropped": dropped,
+            "reduction": round(dropped / self.seen, 4) if self.seen else 0.0,
+            "threshold": self.threshold,
+        }
+
+def deduplicate_chunks(chunks: List[dict], threshold: float = CHUNK_DEDUP_THRESHOLD) -> Tuple[List[dict], Dict[str, str]]:
+    """Drop near-duplicate chunks; returns the survivors and a dropped chunk_id -> surviving chunk_id map."""
+    if threshold <= 0:
+        return list(chunks), {}
+    dedup = NearDuplicateFilter(threshold)
+    kept = list(dedup.iter_unique(chunks))
+    # Survivors carry the pages of the chunks folded into them, so citations still cover every page
+    also_pages = dedup.also_pages()
+    for chunk in kept:
+        if chunk["chunk_id"] in also_pages:
+            chunk["also_pages"] = also_pages[chunk["chunk_id"]]
+    print(f"[INFO] Near-duplicate chunks removed: {dedup.report()}")
+    return kept, dedup.duplicate_of
+
+def save_duplicates(folder: str, duplicate_of: Dict[str, str]):
+    with open(os.path.join(folder, DUPLICATES_FILE), "w", encoding="utf-8") as f:
+        json.dump(duplicate_of, f)
@@ -0,0 +1,127 @@
+import os
+import re
+import zlib
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import JinaEmbeddings
+
+try:
+    from utils.code_files.embedding_cache import CachedEmbeddings, get_embedding_cache
+except ImportError:  # run as a script from utils/code_files
+    from embedding_cache import CachedEmbeddings, get_embedding_cache
+
+EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "jina-embeddings-v3")
+JINA_API_KEY = os.getenv("JINA_API_KEY")
+
+# EMBEDDINGS_MODEL values starting with this prefix select the offline backend, e.g. "local-hash-768"
+LOCAL_MODEL_PREFIX = "local-hash"
+LOCAL_DEFAULT_DIMENSION = 768
+
+class LocalHashingEmbeddings(Embeddings):
+    """Offline embeddings from hashed word and character n-grams (no network, NumPy only).
+
+    Each text becomes a signed feature-hashing vector of word unigrams/bigrams and character
+    3-5 grams with sublinear term frequency, L2-normalised so inner product equals cosine.
+    """
+
+    def __init__(self, dimension: int = LOCAL_DEFAULT_DIMENSION, char_ngrams=(3, 5)):
+        self.dimension = dimension
+        self.char_ngrams = char_ngrams
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r"\w+", text.lower())
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            for n in range(self.char_ngrams[0], self.char_ngrams[1] + 1):
+                features += [padded[i:i + n] for i in range(len(padded) - n + 1)]
+        return features
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        features = self._features(text)
+        if not features:
+            return vector
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        indices = (hashes % self.dimension).astype(np.int64)
+        signs = np.where((hashes >> 31) & 1, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, indices, signs)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t).tolist() for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+def _jina_wrapper_module():
+    """JinaEmbeddingWrapper loads the tiktoken vocabulary (a download on first use), so the
+    offline backend never imports it."""
+    try:
+        from utils.code_files import JinaEmbeddingWrapper as module
+    except ImportError:  # run as a script from utils/code_files
+        import JinaEmbeddingWrapper as module
+    return module
+
+class JinaBackend:
+    """Remote Jina embeddings (the original backend)."""
+
+    is_local = False
+
+    def __init__(self, model_name: str, api_key: str = None):
+        clip_text_to_tokens = _jina_wrapper_module().clip_text_to_tokens
+        self.model_name = model_name
+        self.api_key = api_key or JINA_API_KEY
+        self.client = JinaEmbeddings(model_name=model_name, jina_api_key=self.api_key)
+        # Query embeddings are cached on disk, shared with JinaEmbeddingWrapper and other workers
+        self.query_embeddings = CachedEmbeddings(
+            self.client, model_name=model_name, cache=get_embedding_cache(), clip=clip_text_to_tokens
+        )
+
+    def document_embeddings(self):
+        """Batched, token-clipped embedder for index builds."""
+        return _jina_wrapper_module().JinaEmbeddingWrapper(api_key=self.api_key, model_name=self.model_name)
+
+    def index_path(self, base_path: str) -> str:
+        return base_path
+
+    def mount_http_adapter(self, http_adapter):
+        self.client.session.mount("https://", http_adapter)
+        self.client.session.mount("http://", http_adapter)
+
+class LocalBackend:
+    """Offline hashed n-gram embeddings; keeps its own FAISS index next to the Jina one."""
+
+    is_local = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        match = re.search(r"(\d+)$", model_name)
+        dimension = int(match.group(1)) if match else LOCAL_DEFAULT_DIMENSION
+        self.query_embeddings = LocalHashingEmbeddings(dimension=dimension)
+
+    def document_embeddings(self):
+        return self.query_embeddings
+
+    def index_path(self, base_path: str) -> str:
+        return f"{base_path}_{self.model_name}"
+
+    def mount_http_adapter(self, http_adapter):
+        pass  # No remote calls
+
+def get_embedding_backend(model_name: str = None, api_key: str = None):
+    """Select the embedding backend from EMBEDDINGS_MODEL.
+
+    Falls back to the local backend (with a warning) when Jina is selected but no API key is set.
+    """
+    model_name = model_name or EMBEDDINGS_MODEL
+    if model_name.startswith(LOCAL_MODEL_PREFIX):
+        return LocalBackend(model_name)
+    if not (api_key or JINA_API_KEY):
+        print(f"[WARN] JINA_API_KEY is not set; using offline '{LOCAL_MODEL_PREFIX}' embeddings instead of {model_name}")
+        return LocalBackend(f"{LOCAL_MODEL_PREFIX}-{LOCAL_DEFAULT_DIMENSION}")
+    return JinaBackend(model_name, api_key=api_key)
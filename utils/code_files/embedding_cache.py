@@ -0,0 +1,197 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.dirname(os.path.dirname(script_dir))
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(app_dir, "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Content-addressed store of corpus (document) vectors used by index builds; never evicted
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", os.path.join(app_dir, "embedding_store.sqlite3"))
+# Only refresh an entry's last-access time when it is older than this, to keep reads cheap
+TOUCH_INTERVAL_SECONDS = 300
+# How many writes between size checks
+EVICTION_CHECK_EVERY = 500
+
+class EmbeddingCache:
+    """Persistent (model, text-hash) -> float32 vector cache on SQLite.
+
+    WAL mode lets several uvicorn workers read concurrently while one writes. Least recently
+    used rows are evicted once the table grows past `max_entries` (never when it is None).
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: Optional[int] = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL,"
+                " vector BLOB NOT NULL, last_access REAL NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        hashes = [self.text_hash(t) for t in texts]
+        found = {}
+        conn = self._connection()
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector, last_access FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch]
+            ).fetchall()
+            for text_hash, blob, last_access in rows:
+                found[text_hash] = (np.frombuffer(blob, dtype=np.float32), last_access)
+
+        now = time.time()
+        stale = [(now, model, h) for h, (_, last_access) in found.items() if now - last_access > TOUCH_INTERVAL_SECONDS]
+        if stale:
+            try:
+                with conn:
+                    conn.executemany("UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?", stale)
+            except sqlite3.OperationalError:
+                pass  # Another worker holds the write lock; recency is best-effort
+
+        with self._lock:
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return [found[h][0] if h in found else None for h in hashes]
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((model, self.text_hash(text), vector.shape[0], vector.tobytes(), now))
+        conn = self._connection()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+        except sqlite3.OperationalError:
+            return  # Cache write lost under contention; the vectors are still returned to the caller
+
+        if self.max_entries is None:
+            return
+        with self._lock:
+            self._writes_since_check += len(rows)
+            check = self._writes_since_check >= EVICTION_CHECK_EVERY
+            if check:
+                self._writes_since_check = 0
+        if check:
+            self.evict()
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_many(model, [text], [vector])
+
+    def evict(self):
+        """Drop least recently used rows beyond `max_entries`."""
+        if self.max_entries is None:
+            return
+        conn = self._connection()
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+        except sqlite3.OperationalError:
+            pass
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache instance over the shared on-disk file."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+    return _shared_cache
+
+_shared_store = None
+
+def get_embedding_store() -> EmbeddingCache:
+    """Process-wide content-addressed store of document vectors (text hash -> vector, unbounded)."""
+    global _shared_store
+    with _shared_cache_lock:
+        if _shared_store is None:
+            _shared_store = EmbeddingCache(EMBEDDING_STORE_PATH, max_entries=None)
+    return _shared_store
+
+class CachedEmbeddings(Embeddings):
+    """LangChain `Embeddings` that consults the persistent cache before calling `base`."""
+
+    def __init__(self, base: Embeddings, model_name: str, cache: EmbeddingCache = None,
+                 clip: Callable[[str], str] = None):
+        self.base = base
+        self.model_name = model_name
+        self.cache = cache or get_embedding_cache()
+        self.clip = clip or (lambda text: text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        clipped = [self.clip(t) for t in texts]
+        cached = self.cache.get_many(self.model_name, clipped)
+        # Each distinct missing text is embedded once, however often it repeats
+        missing = list(dict.fromkeys(clipped[i] for i, vector in enumerate(cached) if vector is None))
+        if missing:
+            fresh = self.base.embed_documents(missing)
+            self.cache.put_many(self.model_name, missing, fresh)
+            by_text = {text: np.asarray(vector, dtype=np.float32) for text, vector in zip(missing, fresh)}
+            cached = [by_text[text] if vector is None else vector for text, vector in zip(clipped, cached)]
+        return [vector.tolist() for vector in cached]
+
+    def embed_query(self, text: str) -> List[float]:
+        clipped = self.clip(text)
+        vector = self.cache.get(self.model_name, clipped)
+        if vector is None:
+            vector = self.base.embed_query(clipped)
+            self.cache.put(self.model_name, clipped, vector)
+            return list(vector)
+        return vector.tolist()
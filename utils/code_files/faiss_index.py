@@ -0,0 +1,124 @@
+import os
+import json
+import time
+from typing import Optional
+import faiss
+import numpy as np
+
+# Index variant and tuning knobs; overridable per build from the vector_store CLI
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")  # flat | hnsw | ivf
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))  # 0 = 4 * sqrt(n), capped so k-means is well trained
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+
+INDEX_INFO_FILE = "index_info.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+# FAISS wants at least this many training points per IVF centroid and warns below it
+IVF_MIN_POINTS_PER_CENTROID = 39
+
+def default_params() -> dict:
+    return {
+        "hnsw_m": FAISS_HNSW_M,
+        "ef_construction": FAISS_HNSW_EF_CONSTRUCTION,
+        "ef_search": FAISS_HNSW_EF_SEARCH,
+        "nlist": FAISS_IVF_NLIST,
+        "nprobe": FAISS_IVF_NPROBE,
+    }
+
+def new_index(dimension: int, index_type: str = FAISS_INDEX_TYPE, params: Optional[dict] = None,
+              train_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """Empty L2 index of the requested type, ready for `add` (IVF is trained on `train_vectors`).
+
+    `params` is updated in place with the nlist actually used.
+    """
+    if params is None:
+        params = default_params()
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index
+    if index_type == "ivf":
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError("An IVF index needs training vectors.")
+        n = len(train_vectors)
+        # e.g. 5.3k chunks: 4 * sqrt(n) = 292 lists would need ~11k points; the cap gives 136
+        nlist = params["nlist"] or max(1, min(int(4 * np.sqrt(n)), n // IVF_MIN_POINTS_PER_CENTROID))
+        nlist = min(nlist, n)  # k-means needs at least one point per centroid
+        params["nlist"] = nlist
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_L2)
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        return index
+    raise ValueError(f"Unknown FAISS index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+def build_index(embeddings: np.ndarray, index_type: str = FAISS_INDEX_TYPE, params: Optional[dict] = None) -> faiss.Index:
+    """Build an L2 index of the requested type over float32 embeddings."""
+    params = {**default_params(), **(params or {})}
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = new_index(embeddings.shape[1], index_type, params, train_vectors=embeddings)
+    index.add(embeddings)
+    configure_search(index, {"index_type": index_type, "params": params})
+    return index
+
+def _search_overrides() -> dict:
+    """Query-time parameters explicitly set in the environment win over the recorded ones."""
+    overrides = {}
+    if "FAISS_HNSW_EF_SEARCH" in os.environ:
+        overrides["ef_search"] = FAISS_HNSW_EF_SEARCH
+    if "FAISS_IVF_NPROBE" in os.environ:
+        overrides["nprobe"] = FAISS_IVF_NPROBE
+    return overrides
+
+def configure_search(index: faiss.Index, info: dict):
+    """Apply query-time parameters (efSearch / nprobe) recorded in the index info."""
+    params = {**default_params(), **info.get("params", {}), **_search_overrides()}
+    if info.get("index_type") == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = params["ef_search"]
+    elif info.get("index_type") == "ivf":
+        faiss.downcast_index(index).nprobe = params["nprobe"]
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+def recall_against_flat(index: faiss.Index, embeddings: np.ndarray, k: int = 5, sample: int = 200, seed: int = 0) -> float:
+    """recall@k of `index` versus exact search, using a sample of corpus vectors as queries."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), size=min(sample, len(embeddings)), replace=False)]
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / truth.size
+
+def build_report(index: faiss.Index, embeddings: np.ndarray, index_type: str, build_seconds: float, k: int = 5) -> dict:
+    return {
+        "index_type": index_type,
+        "vectors": int(index.ntotal),
+        "build_seconds": round(build_seconds, 3),
+        "memory_mb": round(index_memory_bytes(index) / 1e6, 2),
+        f"recall@{k}": round(recall_against_flat(index, embeddings, k=k), 4),
+    }
+
+def timed_build(embeddings: np.ndarray, index_type: str, params: Optional[dict] = None):
+    start = time.perf_counter()
+    index = build_index(embeddings, index_type, params)
+    return index, time.perf_counter() - start
+
+def write_index_info(folder: str, info: dict):
+    with open(os.path.join(folder, INDEX_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+def read_index_info(folder: str) -> dict:
+    """Index metadata saved next to the artifact; indexes built before this existed are flat."""
+    path = os.path.join(folder, INDEX_INFO_FILE)
+    if not os.path.exists(path):
+        return {"index_type": "flat", "params": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
@@ -1,12 +1,21 @@
 import os
 import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import fitz  
 import pandas as pd
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import nltk
 # nltk.download("punkt")
 
+try:
+    from utils.code_files.dedup import CHUNK_DEDUP_THRESHOLD, deduplicate_chunks
+except ImportError:  # run as a script from utils/code_files
+    from dedup import CHUNK_DEDUP_THRESHOLD, deduplicate_chunks
+
 # === CONFIGURABLE PARAMETERS ===
 SKIP_INTRO_PAGES = 131  # Pages to skip for font analysis
 SAMPLE_PAGES_FOR_FONT = 20  # Pages used to calculate font threshold
@@ -32,12 +41,11 @@ def extract_topic(text: str) -> str:
 
 
 # === PDF Text Extraction with Dynamic Threshold and Heading Pattern ===
-def extract_paragraphs_with_headings(pdf_path: str) -> List[Tuple[str, str]]:
-    doc = fitz.open(pdf_path)
-    paragraphs = []
-    current_section = "Introduction"
-    min_paragraph_length = 50
+MIN_PARAGRAPH_LENGTH = 50
+DEFAULT_FONT_THRESHOLD = 14
 
+def compute_font_threshold(doc) -> float:
+    """Mean font size over the sample pages plus a buffer; larger lines count as headings."""
     font_sizes = []
 
     # Step 1: Collect font sizes from sample pages
@@ -52,18 +60,24 @@ def extract_paragraphs_with_headings(pdf_path: str) -> List[Tuple[str, str]]:
                         font_sizes.append(span["size"])
 
     # Step 2: Compute dynamic threshold
-    default_threshold = 14
     if font_sizes:
         mean_font = sum(font_sizes) / len(font_sizes)
-        dynamic_font_threshold = mean_font + HEADING_MIN_FONT_BUFFER
-    else:
-        dynamic_font_threshold = default_threshold
+        return mean_font + HEADING_MIN_FONT_BUFFER
+    return DEFAULT_FONT_THRESHOLD
 
-    print(f"[INFO] Using dynamic heading font threshold: {dynamic_font_threshold:.2f}")
+def extract_page_range(doc, start: int, end: int, font_threshold: float,
+                       current_section: Optional[str] = "Introduction") -> Tuple[List[tuple], Optional[str]]:
+    """Paragraphs of pages [start, end) and the section heading in effect after the last page.
+
+    Paragraphs are (section, text, page_number). With `current_section=None` the section in force
+    before `start` is unknown; paragraphs before the first heading then carry None, to be filled
+    in when ranges are merged.
+    """
+    paragraphs = []
 
     # Step 3: Extract paragraphs and detect headings
-    for page_num, page in enumerate(doc):
-        blocks = page.get_text("dict")["blocks"]
+    for page_num in range(start, end):
+        blocks = doc[page_num].get_text("dict")["blocks"]
         current_paragraph = ""
 
         for block in blocks:
@@ -83,26 +97,83 @@ def extract_paragraphs_with_headings(pdf_path: str) -> List[Tuple[str, str]]:
 
                 # Heading pattern detection
                 is_heading_like = bool(re.match(r"^\d+(\.\d+)*\s+.+", line_text.strip())) or \
-                                  (max_font >= dynamic_font_threshold and len(line_text.strip()) < 100)
+                                  (max_font >= font_threshold and len(line_text.strip()) < 100)
 
                 if is_heading_like:
-                    if current_paragraph and len(current_paragraph) >= min_paragraph_length:
+                    if current_paragraph and len(current_paragraph) >= MIN_PARAGRAPH_LENGTH:
                         paragraphs.append((current_section, current_paragraph, page_num + 1))
                         current_paragraph = ""
                     current_section = line_text.strip().title()
                 else:
                     current_paragraph += " " + line_text if current_paragraph else line_text
 
-        if current_paragraph and len(current_paragraph) >= min_paragraph_length:
+        if current_paragraph and len(current_paragraph) >= MIN_PARAGRAPH_LENGTH:
             paragraphs.append((current_section, current_paragraph, page_num + 1))  # +1 to make it 1-indexed
 
+    return paragraphs, current_section
+
+def _extract_range_worker(pdf_path: str, start: int, end: int, font_threshold: float):
+    # Each worker process opens its own document; fitz handles cannot be shared across processes
+    with fitz.open(pdf_path) as doc:
+        return extract_page_range(doc, start, end, font_threshold, current_section=None)
+
+def _page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    # A few ranges per worker keeps the pool busy when some pages are much denser than others
+    size = max(1, -(-page_count // (workers * 4)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def extract_paragraphs_with_headings(pdf_path: str, workers: int = 1) -> List[Tuple[str, str, int]]:
+    """Paragraphs of the whole PDF; `workers > 1` splits page ranges across a process pool.
+
+    Both paths return exactly the same list: ranges are merged in page order and the section
+    heading in force at the end of one range is carried into the next.
+    """
+    with fitz.open(pdf_path) as doc:
+        font_threshold = compute_font_threshold(doc)
+        print(f"[INFO] Using dynamic heading font threshold: {font_threshold:.2f}")
+        page_count = doc.page_count
+        if workers <= 1 or page_count < 2:
+            return extract_page_range(doc, 0, page_count, font_threshold)[0]
+
+    ranges = _page_ranges(page_count, workers)
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _extract_range_worker,
+            repeat(pdf_path), [r[0] for r in ranges], [r[1] for r in ranges], repeat(font_threshold)
+        )
+        paragraphs = []
+        current_section = "Introduction"
+        for range_paragraphs, last_section in results:
+            paragraphs.extend(
+                (section if section is not None else current_section, text, page_number)
+                for section, text, page_number in range_paragraphs
+            )
+            if last_section is not None:
+                current_section = last_section
+
+    elapsed = time.perf_counter() - start_time
+    print(f"[INFO] Extracted {page_count} pages with {workers} workers in {elapsed:.1f}s "
+          f"({page_count / elapsed:.1f} pages/s)")
     return paragraphs
 
+def iter_page_paragraphs(pdf_path: str) -> Iterator[List[tuple]]:
+    """Yield each page's paragraphs in order, one page in memory at a time (streaming ingestion)."""
+    with fitz.open(pdf_path) as doc:
+        font_threshold = compute_font_threshold(doc)
+        print(f"[INFO] Using dynamic heading font threshold: {font_threshold:.2f}")
+        current_section = "Introduction"
+        for page_num in range(doc.page_count):
+            paragraphs, current_section = extract_page_range(doc, page_num, page_num + 1, font_threshold, current_section)
+            yield paragraphs
+
 # === Improved Chunking Strategy ===
-def chunk_with_metadata(paragraphs: List[Tuple[str, str]], book_path: str, book_type: str) -> List[dict]:
+def iter_chunks(paragraphs: Iterable[Tuple[str, str, int]], book_path: str, book_type: str) -> Iterator[dict]:
+    """Chunks in order as paragraphs stream in; only the last chunk is held back, since a
+    following fragment may still be merged into it."""
     book_name = os.path.splitext(os.path.basename(book_path))[0]
     chunk_id = 0
-    all_chunks = []
+    pending = None
 
 
     splitter = RecursiveCharacterTextSplitter(
@@ -128,11 +199,13 @@ def chunk_with_metadata(paragraphs: List[Tuple[str, str]], book_path: str, book_
             # Skip very small chunks (except for the last one)
             if len(chunk) < 100 and chunk_id > 0:
                 # Merge with previous chunk if too small
-                if all_chunks and (len(all_chunks[-1]["text"]) + len(chunk) < 1500):
-                    all_chunks[-1]["text"] += " " + chunk
+                if pending and (len(pending["text"]) + len(chunk) < 1500):
+                    pending["text"] += " " + chunk
                     continue
 
-            all_chunks.append({
+            if pending:
+                yield pending
+            pending = {
                 "text": chunk,
                 "book_name": book_name,
                 "book_type": book_type,
@@ -140,24 +213,46 @@ def chunk_with_metadata(paragraphs: List[Tuple[str, str]], book_path: str, book_
                 "topic": extract_topic(chunk),
                 "page_number": page_number,
                 "chunk_id": f"{book_name}_{chunk_id}"
-            })
+            }
             chunk_id += 1
 
-    return all_chunks
+    if pending:
+        yield pending
+
+def chunk_with_metadata(paragraphs: List[Tuple[str, str]], book_path: str, book_type: str) -> List[dict]:
+    return list(iter_chunks(paragraphs, book_path, book_type))
+
 # === Full Book Processing ===
 def process_book(
     pdf_path: str,
     book_type: str = "treatment",
-    export_path: str = None
+    export_path: str = None,
+    workers: int = 1,
+    dedup_threshold: float = CHUNK_DEDUP_THRESHOLD
 ) -> List[dict]:
     print(f"Processing: {pdf_path}")
-    paragraphs = extract_paragraphs_with_headings(pdf_path)
+    paragraphs = extract_paragraphs_with_headings(pdf_path, workers=workers)
     chunks = chunk_with_metadata(paragraphs, pdf_path, book_type)
+    by_id = {chunk["chunk_id"]: chunk for chunk in chunks}
+    chunks, duplicate_of = deduplicate_chunks(chunks, dedup_threshold)
 
     if export_path:
         df = pd.DataFrame(chunks)
         df.to_csv(export_path, index=False)
         print(f"Exported {len(chunks)} chunks to {export_path}")
+        if duplicate_of:
+            # Dropped chunks keep their page so citations can point at every place the text appeared
+            duplicates_path = f"{os.path.splitext(export_path)[0]}_duplicates.csv"
+            pd.DataFrame([
+                {
+                    "chunk_id": chunk_id,
+                    "duplicate_of": survivor,
+                    "page_number": by_id[chunk_id]["page_number"],
+                    "section_title": by_id[chunk_id]["section_title"],
+                }
+                for chunk_id, survivor in duplicate_of.items()
+            ]).to_csv(duplicates_path, index=False)
+            print(f"Exported {len(duplicate_of)} duplicate mappings to {duplicates_path}")
     return chunks
 
 # def export_debug_html(chunks: List[dict], export_path: str = "debug_output.html") -> None:
@@ -174,7 +269,18 @@ def process_book(
 
 # === Example Usage ===
 if __name__ == "__main__":
-    dsm_chunks = process_book("./docs/DSM-book.pdf", book_type="reference", export_path="dsm_chunks.csv", )
+    parser = argparse.ArgumentParser(description="Extract and chunk a PDF book.")
+    parser.add_argument("--pdf", default="./docs/DSM-book.pdf")
+    parser.add_argument("--book-type", default="reference")
+    parser.add_argument("--export", default="dsm_chunks.csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for page extraction (1 = sequential)")
+    parser.add_argument("--dedup-threshold", type=float, default=CHUNK_DEDUP_THRESHOLD,
+                        help="Jaccard similarity at which chunks count as near-duplicates (0 = keep all)")
+    args = parser.parse_args()
+
+    dsm_chunks = process_book(args.pdf, book_type=args.book_type, export_path=args.export, workers=args.workers,
+                              dedup_threshold=args.dedup_threshold)
     # clinical_chunks = process_book("/content/_Clinical Psychology_ Science, Practice, and Diversity2020.pdf", book_type="practice", export_path="clinical_chunks.csv")
     # export_debug_html(dsm_chunks)
 
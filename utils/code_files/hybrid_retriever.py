@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+from langchain.schema import Document
+
+# Threads shared by all hybrid queries; each query uses one per branch
+HYBRID_RETRIEVER_WORKERS = int(os.getenv("HYBRID_RETRIEVER_WORKERS", "8"))
+
+_branch_executor = ThreadPoolExecutor(max_workers=HYBRID_RETRIEVER_WORKERS, thread_name_prefix="hybrid-branch")
+
+def _timed(fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+class HybridRetriever:
+    """Dense + sparse retrieval run concurrently, fused with weighted reciprocal rank fusion.
+
+    Fusion matches LangChain's `EnsembleRetriever` (score = sum of weight / (rank + c)), so
+    swapping it in keeps result order. The optional reranker (`compress_documents`) runs on the
+    fused list. Per-branch timings of the last query are kept in `last_timings`. Both branch
+    callables receive the metadata `filters` so each can pre-filter its own index.
+    """
+
+    def __init__(self, dense_search: Callable[[str, Optional[Dict]], List[Document]],
+                 sparse_search: Callable[[str, Optional[Dict]], List[Document]],
+                 weights: Sequence[float] = (0.7, 0.3), c: int = 60, reranker=None):
+        self.dense_search = dense_search
+        self.sparse_search = sparse_search
+        self.weights = weights
+        self.c = c
+        self.reranker = reranker
+        self.last_timings = {}
+        self._totals = {}
+        self._queries = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _doc_key(doc: Document):
+        return doc.metadata.get("chunk_id") or doc.page_content
+
+    def fuse(self, ranked_lists: List[List[Document]]) -> List[Document]:
+        """Weighted RRF; a document found by both branches carries both branch scores."""
+        scores = {}
+        merged = {}
+        for docs, weight in zip(ranked_lists, self.weights):
+            for rank, doc in enumerate(docs, start=1):
+                key = self._doc_key(doc)
+                scores[key] = scores.get(key, 0.0) + weight / (rank + self.c)
+                if key in merged:
+                    merged[key].metadata.update(doc.metadata)
+                else:
+                    merged[key] = Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        for key in ordered:
+            merged[key].metadata["fusion_score"] = scores[key]
+        return [merged[key] for key in ordered]
+
+    def invoke(self, query: str, filters: Optional[Dict] = None, **kwargs) -> List[Document]:
+        start = time.perf_counter()
+        dense_future = _branch_executor.submit(_timed, self.dense_search, query, filters)
+        sparse_future = _branch_executor.submit(_timed, self.sparse_search, query, filters)
+        dense_docs, dense_ms = dense_future.result()
+        sparse_docs, sparse_ms = sparse_future.result()
+
+        fused, fusion_ms = _timed(self.fuse, [dense_docs, sparse_docs])
+
+        rerank_ms = 0.0
+        if self.reranker is not None and fused:
+            fused, rerank_ms = _timed(lambda docs: list(self.reranker.compress_documents(docs, query)), fused)
+            for doc in fused:
+                if "relevance_score" in doc.metadata:
+                    doc.metadata["rerank_score"] = doc.metadata["relevance_score"]
+
+        timings = {
+            "dense_ms": round(dense_ms, 2),
+            "sparse_ms": round(sparse_ms, 2),
+            "fusion_ms": round(fusion_ms, 2),
+            "rerank_ms": round(rerank_ms, 2),
+            "total_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+        with self._lock:
+            self.last_timings = timings
+            self._queries += 1
+            for stage, ms in timings.items():
+                self._totals[stage] = self._totals.get(stage, 0.0) + ms
+        return fused
+
+    def stats(self) -> dict:
+        with self._lock:
+            averages = {f"avg_{stage}": round(total / self._queries, 2) for stage, total in self._totals.items()} if self._queries else {}
+            return {"queries": self._queries, "last": self.last_timings, **averages}
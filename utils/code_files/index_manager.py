@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+import pandas as pd
+
+try:
+    from utils.code_files.chunk_store import ChunkTable, ChunkTableWriter
+    from utils.code_files.faiss_index import FAISS_INDEX_TYPE, INDEX_TYPES, default_params, build_index
+    from utils.code_files.bm25_engine import SparseBM25, BM25Tokenizer
+    from utils.code_files.bundle import save_bundle, switch_current, CURRENT_FILE, VERSIONS_DIR
+    from utils.code_files.embedding_cache import CachedEmbeddings, get_embedding_store
+except ImportError:  # run as a script from utils/code_files
+    from chunk_store import ChunkTable, ChunkTableWriter
+    from faiss_index import FAISS_INDEX_TYPE, INDEX_TYPES, default_params, build_index
+    from bm25_engine import SparseBM25, BM25Tokenizer
+    from bundle import save_bundle, switch_current, CURRENT_FILE, VERSIONS_DIR
+    from embedding_cache import CachedEmbeddings, get_embedding_store
+
+STORE_MANIFEST_FILE = "store_manifest.json"
+STORE_INDEX_FILE = "vectors.faiss"
+
+def content_hash(text: str) -> str:
+    """Identity of a chunk's embedding: the same text always maps to the same vector."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class IndexStore:
+    """Incrementally maintained vector store, keyed by chunk content hash.
+
+    Vectors live in an ID-mapped FAISS index (one stable int64 id per distinct text), so
+    syncing a new corpus only embeds texts the store has not seen and removes vectors whose
+    text is gone. The serving bundle is compiled from the stored vectors without any
+    embedding calls (see `compile_bundle`).
+
+    Only the embedding work is incremental: every `save` rewrites the whole version directory,
+    and every `compile_bundle` rebuilds the serving index and BM25 from all stored vectors, so
+    publishing one book costs time proportional to the whole corpus.
+    """
+
+    def __init__(self, folder: str, embeddings_model: str):
+        self.folder = folder
+        self.embeddings_model = embeddings_model
+        self.index = None
+        self.ids_by_hash: Dict[str, int] = {}
+        self.next_id = 0
+        self.chunks: List[dict] = []
+        self.version = None
+
+    # === Persistence ===
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.folder, VERSIONS_DIR, version)
+
+    @classmethod
+    def open(cls, folder: str, embeddings_model: str) -> "IndexStore":
+        """Load the live version of the store, or an empty store if none exists yet."""
+        store = cls(folder, embeddings_model)
+        current = os.path.join(folder, CURRENT_FILE)
+        if not os.path.exists(current):
+            return store
+        with open(current, encoding="utf-8") as f:
+            store.version = f.read().strip()
+        version_dir = store._version_dir(store.version)
+        with open(os.path.join(version_dir, STORE_MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["embeddings_model"] != embeddings_model:
+            raise ValueError(f"Index store at {folder} holds {manifest['embeddings_model']} vectors; "
+                             f"cannot sync {embeddings_model} embeddings into it.")
+        store.ids_by_hash = manifest["ids_by_hash"]
+        store.next_id = manifest["next_id"]
+        store.index = faiss.read_index(os.path.join(version_dir, STORE_INDEX_FILE))
+        table = ChunkTable.load(version_dir, use_mmap=False)
+        store.chunks = [{"text": table.texts[row], **table.metadata(row)} for row in range(len(table))]
+        return store
+
+    def save(self) -> str:
+        """Write a new version directory (all vectors and chunks), then switch CURRENT to it in one atomic rename."""
+        if self.index is None:
+            raise ValueError("The index store is empty; sync some chunks first.")
+        version = uuid.uuid4().hex
+        version_dir = self._version_dir(version)
+        os.makedirs(version_dir)
+        faiss.write_index(self.index, os.path.join(version_dir, STORE_INDEX_FILE))
+        writer = ChunkTableWriter(version_dir)
+        for chunk in self.chunks:
+            writer.append(chunk)
+        writer.close()
+        with open(os.path.join(version_dir, STORE_MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "embeddings_model": self.embeddings_model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "dimension": int(self.index.d),
+                "chunks": len(self.chunks),
+                "next_id": self.next_id,
+                "ids_by_hash": self.ids_by_hash,
+            }, f)
+
+        # Readers never see a half-written store (same layout as the serving bundle)
+        switch_current(self.folder, version)
+
+        # Older versions are no longer reachable
+        for old in os.listdir(os.path.join(self.folder, VERSIONS_DIR)):
+            if old != version:
+                shutil.rmtree(self._version_dir(old), ignore_errors=True)
+        self.version = version
+        return version
+
+    # === Updates ===
+    def sync(self, chunks: List[dict], embedder, batch_size: int = 256) -> dict:
+        """Make the store hold exactly `chunks` (dicts with "text" and chunk metadata).
+
+        Only texts missing from the store are embedded; vectors for texts no longer present
+        are removed. Metadata-only changes reuse the stored vector. New texts are looked up in
+        the shared embedding store first, so vectors embedded by vector_store.py are reused too.
+        """
+        hashes = [content_hash(chunk["text"]) for chunk in chunks]
+        wanted = set(hashes)
+        removed = [h for h in self.ids_by_hash if h not in wanted]
+        new_texts = {}
+        for h, chunk in zip(hashes, chunks):
+            if h not in self.ids_by_hash and h not in new_texts:
+                new_texts[h] = chunk["text"]
+
+        if embedder is not None and not isinstance(embedder, CachedEmbeddings):
+            embedder = CachedEmbeddings(embedder, model_name=self.embeddings_model, cache=get_embedding_store())
+        store_hits = embedder.cache.hits if embedder is not None else 0
+
+        start = time.perf_counter()
+        if removed:
+            self.index.remove_ids(np.asarray([self.ids_by_hash.pop(h) for h in removed], dtype=np.int64))
+        pending = list(new_texts.items())
+        for offset in range(0, len(pending), batch_size):
+            batch = pending[offset:offset + batch_size]
+            vectors = np.asarray(embedder.embed_documents([text for _, text in batch]), dtype=np.float32)
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+            ids = np.arange(self.next_id, self.next_id + len(batch), dtype=np.int64)
+            self.index.add_with_ids(vectors, ids)
+            self.ids_by_hash.update({h: int(i) for (h, _), i in zip(batch, ids)})
+            self.next_id += len(batch)
+
+        self.chunks = list(chunks)
+        return {
+            "chunks": len(chunks),
+            "embedded": len(new_texts),
+            "removed": len(removed),
+            "reused": len(wanted) - len(new_texts),
+            "from_embedding_store": (embedder.cache.hits - store_hits) if embedder is not None else 0,
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+
+    def upsert_book(self, chunks: List[dict], embedder) -> dict:
+        """Replace every chunk of the books in `chunks`, keeping the rest of the corpus."""
+        books = {chunk.get("book_name") for chunk in chunks}
+        kept = [chunk for chunk in self.chunks if chunk.get("book_name") not in books]
+        return self.sync(kept + list(chunks), embedder)
+
+    def remove_book(self, book_name: str, embedder=None) -> dict:
+        return self.sync([chunk for chunk in self.chunks if chunk.get("book_name") != book_name], embedder)
+
+    # === Serving artifacts ===
+    def vectors(self) -> np.ndarray:
+        """Stored vectors in corpus row order (duplicate texts share one stored vector)."""
+        ids = np.asarray([self.ids_by_hash[content_hash(chunk["text"])] for chunk in self.chunks], dtype=np.int64)
+        return self.index.reconstruct_batch(ids)
+
+    def compile_bundle(self, out_folder: str, index_type: str = FAISS_INDEX_TYPE, params: Optional[dict] = None,
+                       stem: bool = False) -> dict:
+        """Build the serving bundle (row-ordered FAISS index, chunk table, BM25) from the saved version.
+
+        This is a full rebuild, not an in-place update: rows shift whenever a book is replaced or
+        removed, and BM25 idf depends on the whole corpus, so both indexes are rebuilt from scratch.
+        """
+        if self.version is None:
+            raise ValueError("Save the store before compiling a bundle from it.")
+        params = {**default_params(), **(params or {})}
+        chunks = ChunkTable.load(self._version_dir(self.version))
+        index = build_index(self.vectors(), index_type, params)
+        bm25 = SparseBM25.from_texts(chunks.texts, documents=chunks, tokenizer=BM25Tokenizer(stem=stem), k=5)
+        index_info = {
+            "index_type": index_type,
+            "params": params,
+            "dimension": int(index.d),
+            "embeddings_model": self.embeddings_model,
+            "store_version": self.version,
+        }
+        return save_bundle(out_folder, index, chunks, bm25, index_info, self.embeddings_model)
+
+def read_chunks_csv(path: str) -> List[dict]:
+    df = pd.read_csv(path)
+    if "text" not in df.columns:
+        raise ValueError("CSV file missing 'text' column. Load correct chunk file.")
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+# === CLI ===
+if __name__ == "__main__":
+    from retriever import RETRIEVAL_BUNDLE_PATH, BM25_STEMMING, app_dir, embedding_backend
+
+    parser = argparse.ArgumentParser(description="Incrementally update the vector store and recompile the retrieval bundle.")
+    parser.add_argument("--store", default=os.path.join(app_dir, "index_store"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Make the store match these chunk CSVs exactly")
+    sync_parser.add_argument("chunks_csv", nargs="+")
+    upsert_parser = subparsers.add_parser("upsert", help="Add or replace the books in these chunk CSVs")
+    upsert_parser.add_argument("chunks_csv", nargs="+")
+    remove_parser = subparsers.add_parser("remove", help="Drop every chunk of a book")
+    remove_parser.add_argument("book_name")
+    subparsers.add_parser("compile", help="Only recompile the bundle from the stored vectors")
+    parser.add_argument("--out", default=RETRIEVAL_BUNDLE_PATH)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=FAISS_INDEX_TYPE)
+    args = parser.parse_args()
+
+    store = IndexStore.open(args.store, embedding_backend.model_name)
+    if args.command != "compile":
+        embedder = embedding_backend.document_embeddings()
+        if args.command == "remove":
+            report = store.remove_book(args.book_name, embedder)
+        else:
+            chunks = [chunk for path in args.chunks_csv for chunk in read_chunks_csv(path)]
+            update = store.sync if args.command == "sync" else store.upsert_book
+            report = update(chunks, embedder)
+        print(f"[INFO] Store updated: {report}")
+        print(f"[INFO] Saved store version {store.save()}")
+
+    manifest = store.compile_bundle(args.out, index_type=args.index_type, stem=BM25_STEMMING)
+    print(f"[INFO] Compiled bundle {manifest['bundle_id']} ({manifest['chunks']} chunks) to {args.out}")
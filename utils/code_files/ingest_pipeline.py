@@ -0,0 +1,301 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Callable, Iterable, Iterator, List
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    from utils.code_files.file_upload_chunks import iter_page_paragraphs, iter_chunks
+    from utils.code_files.embedding_backends import get_embedding_backend
+    from utils.code_files.embedding_cache import CachedEmbeddings, get_embedding_store
+    from utils.code_files.faiss_index import FAISS_INDEX_TYPE, INDEX_TYPES, default_params, new_index, configure_search
+    from utils.code_files.chunk_store import ChunkTableWriter
+    from utils.code_files.bm25_engine import SparseBM25, BM25Tokenizer
+    from utils.code_files.bundle import save_bundle, live_bundle_dir
+    from utils.code_files.dedup import CHUNK_DEDUP_THRESHOLD, NearDuplicateFilter, save_duplicates
+except ImportError:  # run as a script from utils/code_files
+    from file_upload_chunks import iter_page_paragraphs, iter_chunks
+    from embedding_backends import get_embedding_backend
+    from embedding_cache import CachedEmbeddings, get_embedding_store
+    from faiss_index import FAISS_INDEX_TYPE, INDEX_TYPES, default_params, new_index, configure_search
+    from chunk_store import ChunkTableWriter
+    from bm25_engine import SparseBM25, BM25Tokenizer
+    from bundle import save_bundle, live_bundle_dir
+    from dedup import CHUNK_DEDUP_THRESHOLD, NearDuplicateFilter, save_duplicates
+
+load_dotenv()
+
+JINA_API_KEY = os.getenv("JINA_API_KEY")
+EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "jina-embeddings-v3")
+BM25_STEMMING = os.getenv("BM25_STEMMING", "0") == "1"
+
+# Items buffered between two stages; this (not the book size) bounds pipeline memory
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_EMBED_BATCH = int(os.getenv("PIPELINE_EMBED_BATCH", "64"))
+# Embedding requests in flight at once; results are still handed on in order
+PIPELINE_EMBED_CONCURRENCY = int(os.getenv("PIPELINE_EMBED_CONCURRENCY", "4"))
+# Vectors buffered to train an IVF index before the first add
+PIPELINE_IVF_TRAIN_SIZE = int(os.getenv("PIPELINE_IVF_TRAIN_SIZE", "10000"))
+
+_DONE = object()
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class StageStats:
+    """Items a stage produced and how long it ran, for the throughput report."""
+
+    def __init__(self, name: str, unit: str, weight: Callable = None):
+        self.name = name
+        self.unit = unit
+        self.weight = weight or (lambda item: 1)
+        self.count = 0
+        self.started = None
+        self.finished = None
+
+    def rate(self) -> float:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> dict:
+        return {"stage": self.name, self.unit: self.count, f"{self.unit}_per_s": round(self.rate(), 1)}
+
+def _pump(items: Iterable, queue: Queue, stats: StageStats):
+    stats.started = time.perf_counter()
+    try:
+        for item in items:
+            queue.put(item)
+            stats.count += stats.weight(item)
+    except BaseException as e:
+        queue.put(_Failure(e))
+        return
+    finally:
+        stats.finished = time.perf_counter()
+    queue.put(_DONE)
+
+def _drain(queue: Queue) -> Iterator:
+    while True:
+        item = queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+def run_stage(items: Iterable, stats: StageStats) -> Iterator:
+    """Run a generator stage in its own thread, handing results on through a bounded queue."""
+    queue = Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    threading.Thread(target=_pump, args=(items, queue, stats), daemon=True, name=f"ingest-{stats.name}").start()
+    return _drain(queue)
+
+def _flatten(pages: Iterable[List[tuple]]) -> Iterator[tuple]:
+    for paragraphs in pages:
+        yield from paragraphs
+
+def _batches(chunks: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class _BatchEmbeddings:
+    """Routes each pipeline batch to the backend's lightweight per-batch call when it has one,
+    instead of the bulk path with its own pool, checkpoints and progress output."""
+
+    def __init__(self, base):
+        self.base = base
+        self._embed = getattr(base, "embed_batch", base.embed_documents)
+
+    def embed_documents(self, texts: List[str]):
+        return self._embed(texts)
+
+def _embed_batches(batches: Iterable[List[dict]], embedder,
+                   concurrency: int = PIPELINE_EMBED_CONCURRENCY) -> Iterator[tuple]:
+    """Embed batches with up to `concurrency` requests in flight, yielding them in input order."""
+    def embed(batch):
+        return batch, np.asarray(embedder.embed_documents([chunk["text"] for chunk in batch]), dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ingest-embed") as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(embed, batch))
+            if len(in_flight) >= concurrency:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+class StreamingIndexer:
+    """Adds embedded batches to a FAISS index and the chunk table as they arrive.
+
+    Flat and HNSW indexes are created on the first batch; IVF first buffers up to
+    PIPELINE_IVF_TRAIN_SIZE vectors to train its coarse quantizer.
+    """
+
+    def __init__(self, writer: ChunkTableWriter, index_type: str, params: dict):
+        self.writer = writer
+        self.index_type = index_type
+        self.params = params
+        self.index = None
+        self._pending = []  # (batch, vectors) held back until an IVF index can be trained
+
+    def add(self, batch: List[dict], vectors: np.ndarray):
+        if self.index is None:
+            self._pending.append((batch, vectors))
+            buffered = sum(len(v) for _, v in self._pending)
+            if self.index_type == "ivf" and buffered < PIPELINE_IVF_TRAIN_SIZE:
+                return
+            self._create_index()
+            return
+        self._add(batch, vectors)
+
+    def _create_index(self):
+        train = np.concatenate([v for _, v in self._pending]) if self.index_type == "ivf" else None
+        self.index = new_index(self._pending[0][1].shape[1], self.index_type, self.params, train_vectors=train)
+        pending, self._pending = self._pending, []
+        for batch, vectors in pending:
+            self._add(batch, vectors)
+
+    def _add(self, batch: List[dict], vectors: np.ndarray):
+        self.index.add(np.ascontiguousarray(vectors))
+        for chunk in batch:
+            self.writer.append(chunk)
+
+    def finish(self):
+        if self.index is None and self._pending:
+            self._create_index()  # Small book: train IVF on whatever was buffered
+        if self.index is None:
+            raise ValueError("No chunks were produced; nothing to index.")
+        configure_search(self.index, {"index_type": self.index_type, "params": self.params})
+        return self.index
+
+def ingest_pdf(pdf_path: str, out_folder: str, book_type: str = "treatment", index_type: str = FAISS_INDEX_TYPE,
+               params: dict = None, batch_size: int = PIPELINE_EMBED_BATCH,
+               dedup_threshold: float = CHUNK_DEDUP_THRESHOLD) -> dict:
+    """Stream a PDF into a retrieval bundle: pages -> paragraphs -> chunks -> dedup -> embeddings -> index.
+
+    Each stage runs in its own thread with bounded queues in between, so memory stays flat
+    regardless of book size (apart from the index itself). Returns the per-stage throughput.
+    """
+    params = {**default_params(), **(params or {})}
+    backend = get_embedding_backend(EMBEDDINGS_MODEL, api_key=JINA_API_KEY)
+    # Vectors land in the shared embedding store, so publishing the book into the IndexStore
+    # (or re-ingesting it) does not embed anything twice
+    embedder = CachedEmbeddings(_BatchEmbeddings(backend.document_embeddings()), model_name=backend.model_name,
+                                cache=get_embedding_store())
+
+    start = time.perf_counter()
+    page_stats = StageStats("extract", "pages")
+    chunk_stats = StageStats("chunk", "chunks")
+    embed_stats = StageStats("embed", "vectors", weight=lambda item: len(item[0]))
+    index_stats = StageStats("index", "vectors")
+
+    staging = tempfile.mkdtemp(prefix="ingest-", dir=os.path.dirname(os.path.abspath(out_folder)))
+    try:
+        writer = ChunkTableWriter(staging)
+        indexer = StreamingIndexer(writer, index_type, params)
+
+        pages = run_stage(iter_page_paragraphs(pdf_path), page_stats)
+        chunks = run_stage(iter_chunks(_flatten(pages), pdf_path, book_type), chunk_stats)
+        # Near-duplicates are dropped before embedding so they cost neither API calls nor index space
+        dedup = NearDuplicateFilter(dedup_threshold) if dedup_threshold > 0 else None
+        if dedup is not None:
+            chunks = dedup.iter_unique(chunks)
+        embedded = run_stage(_embed_batches(_batches(chunks, batch_size), embedder), embed_stats)
+
+        index_stats.started = time.perf_counter()
+        for batch, vectors in embedded:
+            indexer.add(batch, vectors)
+            index_stats.count += len(batch)
+        index = indexer.finish()
+        index_stats.finished = time.perf_counter()
+
+        # Sparse index and bundle are built from the memory-mapped chunk table
+        chunk_table = writer.close(updates={
+            chunk_id: {"also_pages": pages} for chunk_id, pages in (dedup.also_pages() if dedup else {}).items()
+        })
+        bm25 = SparseBM25.from_texts(chunk_table.texts, documents=chunk_table,
+                                     tokenizer=BM25Tokenizer(stem=BM25_STEMMING), k=5)
+        stages = [s.report() for s in (page_stats, chunk_stats, embed_stats, index_stats)]
+        index_info = {
+            "index_type": index_type,
+            "params": params,
+            "dimension": int(index.d),
+            "embeddings_model": backend.model_name,
+            "report": {"vectors": int(index.ntotal), "stages": stages,
+                       "dedup": dedup.report() if dedup is not None else None},
+        }
+        if dedup is not None:
+            os.makedirs(out_folder, exist_ok=True)
+            save_duplicates(out_folder, dedup.duplicate_of)
+        manifest = save_bundle(out_folder, index, chunk_table, bm25, index_info, backend.model_name)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    for stage in stages:
+        print(f"[INFO] {stage}")
+    if dedup is not None:
+        print(f"[INFO] Near-duplicate chunks removed: {dedup.report()}")
+    print(f"[INFO] Ingested {manifest['chunks']} chunks into {out_folder} in {time.perf_counter() - start:.1f}s")
+    return {"bundle_id": manifest["bundle_id"], "stages": stages,
+            "dedup": dedup.report() if dedup is not None else None}
+
+def publish_book(bundle_folder: str, store_folder: str, serving_bundle: str, index_type: str = FAISS_INDEX_TYPE,
+                 stem: bool = BM25_STEMMING) -> dict:
+    """Add or replace an ingested book in the IndexStore and recompile the serving bundle.
+
+    The other books in the store are kept, and the book's vectors come from the embedding store.
+    """
+    try:
+        from utils.code_files.chunk_store import ChunkTable
+        from utils.code_files.index_manager import IndexStore
+    except ImportError:  # run as a script from utils/code_files
+        from chunk_store import ChunkTable
+        from index_manager import IndexStore
+
+    backend = get_embedding_backend(EMBEDDINGS_MODEL, api_key=JINA_API_KEY)
+    table = ChunkTable.load(live_bundle_dir(bundle_folder))
+    chunks = [{"text": table.texts[row], **table.metadata(row)} for row in range(len(table))]
+    store = IndexStore.open(store_folder, backend.model_name)
+    report = store.upsert_book(chunks, backend.document_embeddings())
+    store.save()
+    manifest = store.compile_bundle(serving_bundle, index_type=index_type, stem=stem)
+    print(f"[INFO] Published {len(chunks)} chunks: {report}; serving bundle {manifest['bundle_id']} "
+          f"holds {manifest['chunks']} chunks")
+    return report
+
+if __name__ == "__main__":
+    from retriever import RETRIEVAL_BUNDLE_PATH, app_dir
+
+    parser = argparse.ArgumentParser(description="Stream a PDF book into a retrieval bundle with bounded memory.")
+    parser.add_argument("--pdf", default="./docs/DSM-book.pdf")
+    parser.add_argument("--book-type", default="reference")
+    # A per-book staging bundle by default: the serving bundle holds the whole corpus, not one book
+    parser.add_argument("--out", help="Bundle folder for this book (default: ingest_bundles/<book name>)")
+    parser.add_argument("--publish", action="store_true",
+                        help="Upsert the book into the index store and recompile the serving bundle")
+    parser.add_argument("--store", default=os.path.join(app_dir, "index_store"))
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=FAISS_INDEX_TYPE)
+    parser.add_argument("--batch-size", type=int, default=PIPELINE_EMBED_BATCH)
+    parser.add_argument("--dedup-threshold", type=float, default=CHUNK_DEDUP_THRESHOLD)
+    args = parser.parse_args()
+
+    book_name = os.path.splitext(os.path.basename(args.pdf))[0]
+    out = args.out or os.path.join(app_dir, "ingest_bundles", book_name)
+    if os.path.abspath(out) == os.path.abspath(RETRIEVAL_BUNDLE_PATH):
+        parser.error("--out would replace the whole serving corpus with this book; use --publish instead")
+    ingest_pdf(args.pdf, out, book_type=args.book_type, index_type=args.index_type, batch_size=args.batch_size,
+               dedup_threshold=args.dedup_threshold)
+    if args.publish:
+        publish_book(out, args.store, RETRIEVAL_BUNDLE_PATH, index_type=args.index_type)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:  # Optional; only used where neither /proc nor resource is available
+    psutil = None
+
+# Fields from /proc/self/smaps_rollup worth reporting; Pss splits shared pages across the processes mapping them
+_SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+def process_memory() -> dict:
+    """Current resident memory of this process in bytes.
+
+    Uses /proc/self/smaps_rollup on Linux, which separates pages shared with other workers
+    (memory-mapped index and chunk files) from private ones. Elsewhere only (peak) RSS is
+    available, and nothing at all on Windows without psutil.
+    """
+    path = "/proc/self/smaps_rollup"
+    if os.path.exists(path):
+        stats = {}
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in _SMAPS_FIELDS:
+                    stats[_SMAPS_FIELDS[key]] = int(value.split()[0]) * 1024
+        return stats
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"peak_rss": peak if sys.platform == "darwin" else peak * 1024}
+    if psutil is not None:
+        return {"rss": psutil.Process().memory_info().rss}
+    return {}
+
+def memory_delta(before: dict, after: dict) -> dict:
+    """Per-field growth between two `process_memory()` snapshots, in MiB."""
+    return {
+        f"{key}_mb": round((after[key] - before.get(key, 0)) / (1024 * 1024), 1)
+        for key in after
+    }
@@ -0,0 +1,147 @@
+from typing import Dict, List, Optional, Sequence, Union
+import faiss
+import numpy as np
+from langchain.schema import Document
+
+# Metadata fields that retrieval can be scoped by
+FILTER_FIELDS = ("topic", "section_title", "book_name", "book_type")
+
+# Below this many candidates, score the subset exactly instead of searching the ANN graph
+EXACT_SCAN_LIMIT = 4096
+
+FilterValue = Union[str, Sequence[str]]
+
+class MetadataIndex:
+    """Maps each filterable metadata value to the sorted array of row ids that carry it."""
+
+    def __init__(self, ids_by_field: Dict[str, Dict[str, np.ndarray]], size: int):
+        self.ids_by_field = ids_by_field
+        self.size = size
+
+    @classmethod
+    def from_metadata(cls, metadatas: Sequence[dict]) -> "MetadataIndex":
+        buckets = {field: {} for field in FILTER_FIELDS}
+        for row_id, metadata in enumerate(metadatas):
+            for field in FILTER_FIELDS:
+                value = metadata.get(field)
+                if isinstance(value, str) and value:
+                    buckets[field].setdefault(value, []).append(row_id)
+        ids_by_field = {
+            field: {value: np.asarray(ids, dtype=np.int64) for value, ids in values.items()}
+            for field, values in buckets.items()
+        }
+        return cls(ids_by_field, len(metadatas))
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document]) -> "MetadataIndex":
+        return cls.from_metadata([doc.metadata for doc in documents])
+
+    @classmethod
+    def from_chunks(cls, chunks) -> "MetadataIndex":
+        """Build from a `ChunkTable`'s interned columns without materialising per-row dicts."""
+        ids_by_field = {
+            field: {value: ids for value, ids in chunks.groups(field).items() if isinstance(value, str) and value}
+            for field in FILTER_FIELDS
+        }
+        return cls(ids_by_field, len(chunks))
+
+    def values(self, field: str) -> List[str]:
+        return sorted(self.ids_by_field.get(field, {}))
+
+    def select(self, filters: Optional[Dict[str, FilterValue]]) -> Optional[np.ndarray]:
+        """Row ids matching every field (a list of values matches any of them); None means unfiltered."""
+        if not filters:
+            return None
+        selected = None
+        for field, wanted in filters.items():
+            if field not in self.ids_by_field:
+                raise ValueError(f"Cannot filter on '{field}'. Expected one of {FILTER_FIELDS}.")
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            matches = [self.ids_by_field[field][v] for v in wanted if v in self.ids_by_field[field]]
+            ids = np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64)
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+        return selected
+
+def validate_filters(filters: Optional[Dict[str, FilterValue]]):
+    for field in filters or {}:
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter on '{field}'. Expected one of {FILTER_FIELDS}.")
+
+class FilteredDenseSearch:
+    """Dense search over a FAISS index, restricted to matching ids before the search.
+
+    Small candidate sets are scored exactly from reconstructed vectors; larger ones are searched
+    with a FAISS ID selector. Either way k results come back whenever k matches exist.
+    `chunks` is the `ChunkTable` whose row ids coincide with FAISS ids.
+    """
+
+    def __init__(self, index, embeddings, chunks, metadata_index: MetadataIndex = None, k: int = 5):
+        self.index = index
+        self.embeddings = embeddings
+        self.chunks = chunks
+        self.metadata_index = metadata_index or MetadataIndex.from_chunks(chunks)
+        self.k = k
+        self._base_index = faiss.downcast_index(self.index)
+        if isinstance(self._base_index, faiss.IndexIVF):
+            self._base_index.make_direct_map()  # Needed to reconstruct vectors by id
+
+    @staticmethod
+    def dense_score(distances: np.ndarray) -> np.ndarray:
+        """Squared L2 distance -> cosine similarity in [0, 1] (embeddings are unit-normalised)."""
+        return np.clip(1.0 - distances / 2.0, 0.0, 1.0)
+
+    def _documents(self, ids: np.ndarray, distances: np.ndarray) -> List[Document]:
+        documents = []
+        for i, score in zip(ids, self.dense_score(distances)):
+            if i < 0:
+                continue
+            documents.append(self.chunks.document(int(i), dense_score=float(score)))
+        return documents
+
+    def _search_params(self, selector):
+        if isinstance(self._base_index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self._base_index.hnsw.efSearch)
+        if isinstance(self._base_index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self._base_index.nprobe)
+        return faiss.SearchParameters(sel=selector)
+
+    def _exact_subset(self, query_vector: np.ndarray, ids: np.ndarray, k: int):
+        vectors = self.index.reconstruct_batch(ids)
+        distances = ((vectors - query_vector) ** 2).sum(axis=1)
+        top = np.argpartition(distances, k - 1)[:k] if len(ids) > k else np.arange(len(ids))
+        top = top[np.argsort(distances[top])]
+        return ids[top], distances[top]
+
+    def search(self, query: str, filters: Optional[Dict[str, FilterValue]] = None, k: int = None) -> List[Document]:
+        """Top-k documents (copies) with a `dense_score` cosine similarity in their metadata."""
+        k = k or self.k
+        query_vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        allowed = self.metadata_index.select(filters)
+
+        if allowed is None:
+            distances, ids = self.index.search(query_vector, k)
+            return self._documents(ids[0], distances[0])
+        if len(allowed) == 0:
+            return []
+        if len(allowed) <= EXACT_SCAN_LIMIT:
+            return self._documents(*self._exact_subset(query_vector[0], allowed, k))
+
+        params = self._search_params(faiss.IDSelectorBatch(allowed))
+        distances, ids = self.index.search(query_vector, k, params=params)
+        if (ids[0] >= 0).sum() < min(k, len(allowed)):
+            # ANN search ran out of candidates inside the filter; fall back to an exact scan
+            return self._documents(*self._exact_subset(query_vector[0], allowed, k))
+        return self._documents(ids[0], distances[0])
+
+    def invoke(self, query: str, filters: Optional[Dict[str, FilterValue]] = None, **kwargs) -> List[Document]:
+        return self.search(query, filters=filters)
+
+class ScopedRetriever:
+    """Binds fixed metadata filters to a retriever that accepts `filters`."""
+
+    def __init__(self, retriever, filters: Dict[str, FilterValue]):
+        self.retriever = retriever
+        self.filters = filters
+
+    def invoke(self, query: str, **kwargs) -> List[Document]:
+        return self.retriever.invoke(query, filters=self.filters, **kwargs)
@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from langchain.schema import Document
+
+# Metadata keys that belong to the chunk itself; anything else (e.g. relevance_score) is per-query
+CHUNK_METADATA_KEYS = {"chunk_id", "section_title", "topic", "book_name", "book_type", "page_number"}
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop surrounding punctuation."""
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" ?!.,;:'\"")
+
+def artifact_fingerprint(paths: List[str]) -> tuple:
+    """Cheap version stamp of the index artifacts (size and mtime of each file)."""
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamp.append((path, None, None))
+    return tuple(stamp)
+
+class RetrievalCache:
+    """LRU/TTL cache of retrieval results in front of a deterministic retriever.
+
+    Entries hold only chunk ids plus per-query scores; `Document`s are rebuilt from the
+    corpus on a hit. The whole cache is dropped when any artifact in `artifact_paths` changes.
+    """
+
+    def __init__(self, retriever, chunk_lookup: Callable[[str], Optional[Document]],
+                 row_lookup: Callable[[str], Optional[int]], artifact_paths: List[str],
+                 max_entries: int = 512, ttl: int = 3600, fingerprint_interval: float = 5.0):
+        self.retriever = retriever
+        self.chunk_lookup = chunk_lookup
+        self.row_lookup = row_lookup  # Existence check only, without building a Document
+        self.artifact_paths = artifact_paths
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fingerprint_interval = fingerprint_interval
+        self._entries = OrderedDict()  # key -> (created_at, [(chunk_id, extra_metadata), ...])
+        self._lock = threading.Lock()
+        self._fingerprint = artifact_fingerprint(artifact_paths)
+        self._fingerprint_checked = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self):
+        now = time.monotonic()
+        if now - self._fingerprint_checked < self.fingerprint_interval:
+            return
+        self._fingerprint_checked = now
+        fingerprint = artifact_fingerprint(self.artifact_paths)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._entries.clear()
+            self.invalidations += 1
+
+    def _key(self, query: str, kwargs: Dict) -> tuple:
+        return (normalize_query(query), json.dumps(kwargs, sort_keys=True, default=str), self._fingerprint)
+
+    def _compact(self, documents: List[Document]):
+        compact = []
+        for doc in documents:
+            chunk_id = doc.metadata.get("chunk_id")
+            if chunk_id is None or self.row_lookup(chunk_id) is None:
+                return None  # Cannot rebuild this result faithfully; don't cache it
+            extras = {k: v for k, v in doc.metadata.items() if k not in CHUNK_METADATA_KEYS}
+            compact.append((chunk_id, extras))
+        return compact
+
+    def _expand(self, compact) -> List[Document]:
+        documents = []
+        for chunk_id, extras in compact:
+            base = self.chunk_lookup(chunk_id)
+            documents.append(Document(page_content=base.page_content, metadata={**base.metadata, **extras}))
+        return documents
+
+    def invoke(self, query: str, **kwargs) -> List[Document]:
+        with self._lock:
+            self._check_fingerprint()
+            key = self._key(query, kwargs)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._expand(entry[1])
+            self.misses += 1
+
+        documents = self.retriever.invoke(query, **kwargs)
+
+        compact = self._compact(documents)
+        if compact is not None:
+            with self._lock:
+                self._entries[key] = (time.monotonic(), compact)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return documents
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,21 +1,53 @@
 import os
+import time
+import threading
 import pandas as pd
-from langchain_community.embeddings import JinaEmbeddings
-from langchain.retrievers import EnsembleRetriever, ContextualCompressionRetriever
 from langchain.schema import Document
 from dotenv import load_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain_cohere import CohereRerank
 
+try:
+    from utils.code_files.retrieval_cache import RetrievalCache
+    from utils.code_files.embedding_backends import get_embedding_backend
+    from utils.code_files.hybrid_retriever import HybridRetriever
+    from utils.code_files.bm25_engine import SparseBM25, BM25Tokenizer
+    from utils.code_files.faiss_index import configure_search, read_index_info, INDEX_INFO_FILE
+    from utils.code_files.metadata_filter import MetadataIndex, FilteredDenseSearch, ScopedRetriever
+    from utils.code_files.bundle import (
+        load_bundle, read_manifest, chunks_from_faiss_store, bundle_artifact_paths, current_bundle_version,
+        bundle_version_dir
+    )
+    from utils.code_files.memory_stats import process_memory, memory_delta
+except ImportError:  # run as a script from utils/code_files
+    from retrieval_cache import RetrievalCache
+    from embedding_backends import get_embedding_backend
+    from hybrid_retriever import HybridRetriever
+    from bm25_engine import SparseBM25, BM25Tokenizer
+    from faiss_index import configure_search, read_index_info, INDEX_INFO_FILE
+    from metadata_filter import MetadataIndex, FilteredDenseSearch, ScopedRetriever
+    from bundle import (
+        load_bundle, read_manifest, chunks_from_faiss_store, bundle_artifact_paths, current_bundle_version,
+        bundle_version_dir
+    )
+    from memory_stats import process_memory, memory_delta
+
 # Load environment
 load_dotenv()
 
 # Load paths from .env
 FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index")
 CHUNKS_CSV_PATH = os.getenv("CHUNKS_CSV_PATH", "dsm_chunks.csv")
+RETRIEVAL_BUNDLE_DIR = os.getenv("RETRIEVAL_BUNDLE_PATH", "retrieval_bundle")
 JINA_API_KEY = os.getenv("JINA_API_KEY")
+EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "jina-embeddings-v3")
+BM25_STEMMING = os.getenv("BM25_STEMMING", "0") == "1"
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+# Memory-map the bundle's index and chunk text so uvicorn workers share one copy
+RETRIEVAL_MMAP = os.getenv("RETRIEVAL_MMAP", "1") == "1"
+# Seconds between checks for a newly published bundle; the runtime is reloaded when one appears
+RETRIEVAL_RELOAD_INTERVAL = float(os.getenv("RETRIEVAL_RELOAD_INTERVAL", "5"))
 
 def filter_and_sort_documents(documents, score_key="relevance_score", threshold=0.01, top_k=3):
     """Filter by score, sort descending, return top_k."""
@@ -26,77 +58,233 @@ def filter_and_sort_documents(documents, score_key="relevance_score", threshold=
     sorted_docs = sorted(filtered, key=lambda d: d.metadata[score_key], reverse=True)
     return sorted_docs[:top_k]
 
-# Load metadata and create LangChain-compatible docs
+# Resolve artifact paths relative to the App directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Move up to App directory and then to utils
 app_dir = os.path.dirname(os.path.dirname(script_dir))  # Up to App from code_files
 csv_path = os.path.join(app_dir, CHUNKS_CSV_PATH)
-# print(f"Attempting to load CSV from: {csv_path}")  # Debug print
-df = pd.read_csv(csv_path)
-if "text" not in df.columns:
-    raise ValueError("CSV file missing 'text' column. Load correct chunk file.")
-
-docs = [
-    Document(
-        page_content=row["text"],
-        metadata={
-            "chunk_id": row.get("chunk_id"),
-            "section_title": row.get("section_title"),
-            "topic": row.get("topic"),
-            "book_name": row.get("book_name", ""),
-            "book_type": row.get("book_type", ""),
-            "page_number": row.get("page_number", None),
-        }
-    )
-    for _, row in df.iterrows()
-]
 
-# === Load FAISS vector index ===
-embedding_model = JinaEmbeddings(
-    model_name="jina-embeddings-v3",
-    jina_api_key=JINA_API_KEY
-)
-faiss_store = FAISS.load_local(
-    folder_path=os.path.join(app_dir, os.path.splitext(FAISS_INDEX_PATH)[0]),  # Adjust path to App/utils/faiss_index
-    embeddings=embedding_model,
-    index_name="index",
-    allow_dangerous_deserialization=True
+# === Embedding backend (cheap to create; no corpus loaded yet) ===
+# EMBEDDINGS_MODEL selects Jina (remote) or a local offline backend; each has its own index
+embedding_backend = get_embedding_backend(EMBEDDINGS_MODEL, api_key=JINA_API_KEY)
+embedding_model = embedding_backend.query_embeddings
+faiss_folder = embedding_backend.index_path(
+    os.path.join(app_dir, os.path.splitext(FAISS_INDEX_PATH)[0])  # Adjust path to App/utils/faiss_index
 )
+RETRIEVAL_BUNDLE_PATH = embedding_backend.index_path(os.path.join(app_dir, RETRIEVAL_BUNDLE_DIR))
 
-# === Setup BM25 Retriever (metadata-based) ===
-bm25 = BM25Retriever.from_documents(docs)
-bm25.k = 5
+# === Optional Re-ranking with Cohere ===
+cohere_key = os.getenv("COHERE_API_KEY")
+reranker = CohereRerank(top_n=5, cohere_api_key=cohere_key, model="rerank-english-v3.0") if cohere_key else None
 
-# === Setup Hybrid Retriever ===
-hybrid_retriever = EnsembleRetriever(
-    retrievers=[faiss_store.as_retriever(search_kwargs={"k": 5}), bm25],
-    weights=[0.7, 0.3]
-)
+def load_chunk_documents():
+    """Chunk CSV as LangChain documents (only needed to build an index from scratch)."""
+    df = pd.read_csv(csv_path)
+    if "text" not in df.columns:
+        raise ValueError("CSV file missing 'text' column. Load correct chunk file.")
+    return [
+        Document(
+            page_content=row["text"],
+            metadata={
+                "chunk_id": row.get("chunk_id"),
+                "section_title": row.get("section_title"),
+                "topic": row.get("topic"),
+                "book_name": row.get("book_name", ""),
+                "book_type": row.get("book_type", ""),
+                "page_number": row.get("page_number", None),
+            }
+        )
+        for row in df.to_dict(orient="records")
+    ]
+
+def load_faiss_store():
+    """Load the LangChain FAISS artifact written by vector_store.py, plus its index info."""
+    if embedding_backend.is_local and not os.path.exists(os.path.join(faiss_folder, "index.faiss")):
+        # The offline index is cheap to build, so create it on first use
+        print(f"[INFO] Building local FAISS index at {faiss_folder}")
+        FAISS.from_documents(load_chunk_documents(), embedding=embedding_model).save_local(faiss_folder)
+    faiss_store = FAISS.load_local(
+        folder_path=faiss_folder,
+        embeddings=embedding_model,
+        index_name="index",
+        allow_dangerous_deserialization=True
+    )
+    return faiss_store, read_index_info(faiss_folder)
+
+class RetrievalRuntime:
+    """Everything retrieval needs in memory, loaded once per process.
+
+    Prefers the compiled bundle (see bundle.py); without one it falls back to the FAISS
+    artifact and builds the sparse index in process. `startup_report` records how long
+    each stage took and how much resident memory loading added to this process.
+    """
+
+    def __init__(self):
+        start = time.perf_counter()
+        memory_before = process_memory()
+        report = {}
+        # Resolved once, so the manifest and the files always come from the same version
+        self.bundle_version = current_bundle_version(RETRIEVAL_BUNDLE_PATH)
+        bundle_folder = bundle_version_dir(RETRIEVAL_BUNDLE_PATH, self.bundle_version)
+        manifest = read_manifest(bundle_folder)
+        if manifest is not None and manifest.get("embeddings_model") != embedding_backend.model_name:
+            print(f"[WARN] Ignoring bundle built for {manifest.get('embeddings_model')}; "
+                  f"current model is {embedding_backend.model_name}")
+            manifest = None
+
+        if manifest is not None:
+            manifest, index, chunks, bm25, timings = load_bundle(bundle_folder, use_mmap=RETRIEVAL_MMAP)
+            index_info = manifest["index_info"]
+            artifact_paths = bundle_artifact_paths(bundle_folder)
+            report.update(source="bundle", bundle_id=manifest["bundle_id"], mmap=RETRIEVAL_MMAP, **timings)
+        else:
+            print(f"[INFO] No retrieval bundle at {RETRIEVAL_BUNDLE_PATH}; loading FAISS artifact "
+                  f"(run utils/code_files/bundle.py to speed up cold starts)")
+            stage = time.perf_counter()
+            faiss_store, index_info = load_faiss_store()
+            index = faiss_store.index
+            chunks = chunks_from_faiss_store(faiss_store)
+            report["index_s"] = time.perf_counter() - stage
+
+            stage = time.perf_counter()
+            bm25 = SparseBM25.from_texts(chunks.texts, documents=chunks, tokenizer=BM25Tokenizer(stem=BM25_STEMMING), k=5)
+            report["bm25_s"] = time.perf_counter() - stage
+            artifact_paths = [
+                os.path.join(faiss_folder, "index.faiss"),
+                os.path.join(faiss_folder, "index.pkl"),
+                os.path.join(faiss_folder, INDEX_INFO_FILE),
+            ]
+            report["source"] = "faiss_artifact"
+
+        # Restore query-time parameters (efSearch / nprobe) for HNSW and IVF indexes
+        configure_search(index, index_info)
+
+        # === Metadata pre-filtering (topic / section_title / book_name / book_type -> id sets) ===
+        stage = time.perf_counter()
+        self.chunks = chunks
+        self.bm25 = bm25
+        self.metadata_index = MetadataIndex.from_chunks(chunks)
+        self.dense_search = FilteredDenseSearch(index, embedding_model, chunks, self.metadata_index, k=5)
+        report["metadata_index_s"] = time.perf_counter() - stage
 
-# === Metadata Filtering (example) ===
+        # === Setup Hybrid Retriever (dense and sparse branches run concurrently) ===
+        self.hybrid_retriever = HybridRetriever(
+            dense_search=self.dense_search.invoke,
+            sparse_search=self.sparse_search,
+            weights=[0.7, 0.3],
+            reranker=reranker
+        )
+
+        # === Final Retriever for RAG (cached per normalized query and index version) ===
+        self.rag_retriever = RetrievalCache(
+            self.hybrid_retriever,
+            chunk_lookup=chunks.document_by_chunk_id,
+            row_lookup=chunks.row_for_chunk_id,
+            artifact_paths=artifact_paths,
+            max_entries=RETRIEVAL_CACHE_SIZE,
+            ttl=RETRIEVAL_CACHE_TTL
+        )
+
+        report["chunks"] = len(chunks)
+        report["total_s"] = time.perf_counter() - start
+        self.startup_report = {k: round(v, 3) if isinstance(v, float) else v for k, v in report.items()}
+        # Mapped pages are only counted once touched, and as shared rather than private
+        self.startup_report["memory"] = memory_delta(memory_before, process_memory())
+        print(f"[INFO] Retrieval ready: {self.startup_report}")
+
+    def memory(self) -> dict:
+        """Resident memory of this worker now (the retriever dominates it), in MiB."""
+        return {f"{key}_mb": round(value / (1024 * 1024), 1) for key, value in process_memory().items()}
+
+    def sparse_search(self, query, filters=None):
+        return self.bm25.invoke(query, allowed_ids=self.metadata_index.select(filters))
+
+_runtime = None
+_runtime_lock = threading.Lock()
+_bundle_checked = 0.0
+
+def _bundle_published() -> bool:
+    """Whether a different bundle version went live since the runtime was loaded (rate limited)."""
+    global _bundle_checked
+    now = time.monotonic()
+    if now - _bundle_checked < RETRIEVAL_RELOAD_INTERVAL:
+        return False
+    _bundle_checked = now
+    return current_bundle_version(RETRIEVAL_BUNDLE_PATH) != _runtime.bundle_version
+
+def get_runtime() -> RetrievalRuntime:
+    """Load the retrieval runtime on first use, and again when a new bundle is published (thread-safe).
+
+    While a new bundle loads, other threads keep answering from the previous runtime.
+    """
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                use_shared_clients()
+                _runtime = RetrievalRuntime()
+    elif _bundle_published() and _runtime_lock.acquire(blocking=False):
+        try:
+            print(f"[INFO] New retrieval bundle published at {RETRIEVAL_BUNDLE_PATH}; reloading")
+            _runtime = RetrievalRuntime()
+        except Exception as e:
+            # Keep serving the loaded bundle; the next check retries
+            print(f"[WARN] Retrieval reload failed ({e}); keeping bundle {_runtime.bundle_version}")
+        finally:
+            _runtime_lock.release()
+    return _runtime
+
+class LazyRetriever:
+    """Module-level `rag_retriever`; importing this module stays cheap until the first query."""
+
+    def invoke(self, query, **kwargs):
+        return get_runtime().rag_retriever.invoke(query, **kwargs)
+
+rag_retriever = LazyRetriever()
+
+# === Metadata Filtering (dense-only, restricted before the vector search) ===
 def get_filtered_retriever(topic=None, section_title=None):
     filters = {}
     if topic:
         filters["topic"] = topic
     if section_title:
         filters["section_title"] = section_title
-    return faiss_store.as_retriever(
-        search_kwargs={"k": 5, "filter": filters}
-    )
+    return ScopedRetriever(get_runtime().dense_search, filters)
 
-# === Optional Re-ranking with Cohere ===
-cohere_key = os.getenv("COHERE_API_KEY")
-if cohere_key:
-    reranker = CohereRerank(top_n=5, cohere_api_key=cohere_key, model="rerank-english-v3.0")
-    retriever_with_rerank = ContextualCompressionRetriever(
-        base_compressor=reranker,
-        base_retriever=hybrid_retriever
-    )
-else:
-    retriever_with_rerank = hybrid_retriever
+def retrieval_stats() -> dict:
+    """Startup, cache and timing stats; empty until the runtime has been loaded."""
+    if _runtime is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "startup": _runtime.startup_report,
+        "cache": _runtime.rag_retriever.stats(),
+        "timings": _runtime.hybrid_retriever.stats(),
+        "memory": _runtime.memory(),
+    }
+
+# === Shared HTTP clients ===
+_shared_clients_attached = False
+
+def use_shared_clients():
+    """Route the Jina and Cohere clients through the app's shared keep-alive pools (core.clients).
 
-# === Final Retriever for RAG ===
-rag_retriever = retriever_with_rerank
+    Runs once, when the runtime is first loaded; outside the app (scripts run from
+    utils/code_files) the clients keep their own connections.
+    """
+    global _shared_clients_attached
+    if _shared_clients_attached:
+        return
+    _shared_clients_attached = True
+    try:
+        from core.clients import get_registry
+    except ImportError:  # run as a script from utils/code_files
+        return
+    registry = get_registry()
+    embedding_backend.mount_http_adapter(registry.http_adapter)
+    if reranker is not None:
+        # Rebuild the client class langchain_cohere chose (ClientV2 in current releases) on the shared pool
+        reranker.client = type(reranker.client)(api_key=cohere_key, httpx_client=registry.http_client)
 
 # === Example Usage ===
 if __name__ == "__main__":
@@ -107,4 +295,4 @@ if __name__ == "__main__":
         print(f"\n--- Top Document {i+1} ---")
         print(doc.page_content[:500])
         print("Metadata:", doc.metadata)
-    print(f"\nRetrieved {len(results)} documents, showing top {len(top_results)} after filtering.")
\ No newline at end of file
+    print(f"\nRetrieved {len(results)} documents, showing top {len(top_results)} after filtering.")
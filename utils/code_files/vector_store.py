@@ -1,12 +1,17 @@
 import os
-import faiss
+import uuid
+import argparse
 import numpy as np
 import pandas as pd
 from langchain_community.embeddings import JinaEmbeddings
 from langchain.vectorstores import FAISS
 from dotenv import load_dotenv
 import tiktoken
-import JinaEmbeddingWrapper
+from embedding_backends import get_embedding_backend
+from embedding_cache import CachedEmbeddings, get_embedding_store
+from faiss_index import (
+    FAISS_INDEX_TYPE, INDEX_TYPES, default_params, timed_build, build_report, write_index_info
+)
 from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
 
@@ -19,20 +24,25 @@ CHUNKS_CSV_PATH = os.getenv('CHUNKS_CSV_PATH', 'dsm_chunks.csv')  # Path to chun
 FAISS_INDEX_PATH = os.getenv('FAISS_INDEX_PATH', 'faiss_index')  # Folder name only
 METADATA_CSV_PATH = os.getenv('METADATA_CSV_PATH', 'faiss_metadata.csv')
 
-# Jina model name (optional override)
+# Embedding model name; "local-hash[-<dim>]" selects the offline backend
 EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'jina-embeddings-v3')
+embedding_backend = get_embedding_backend(EMBEDDINGS_MODEL, api_key=JINA_API_KEY)
 
 
-def get_jina_embeddings(texts):
-    embedder = JinaEmbeddingWrapper.JinaEmbeddingWrapper(api_key=JINA_API_KEY)
-    return embedder.embed_documents(texts)
+def get_embeddings(texts):
+    """Embed each distinct text once; vectors already in the embedding store are reused."""
+    store = get_embedding_store()
+    embedder = CachedEmbeddings(embedding_backend.document_embeddings(), model_name=embedding_backend.model_name, cache=store)
+    hits, misses = store.hits, store.misses
+    embeddings = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+    print(f"[INFO] Embedding store: {store.hits - hits} vectors reused, {store.misses - misses} texts needed embedding")
+    return embeddings
 
 
 # === FAISS Index Creation ===
-def create_faiss_index(embeddings, metadata, faiss_index_path, metadata_csv_path):
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)  #using flat L2 Indexing for simplicity and small chunks
-    index.add(embeddings)
+def create_faiss_index(embeddings, metadata, faiss_index_path, metadata_csv_path, index_type=FAISS_INDEX_TYPE, params=None):
+    # flat is exact; hnsw/ivf trade a little recall for sub-linear query cost on large corpora
+    index, build_seconds = timed_build(embeddings, index_type, params)
 
     docs = [
         Document(
@@ -42,22 +52,46 @@ def create_faiss_index(embeddings, metadata, faiss_index_path, metadata_csv_path
         for i in range(len(metadata))
     ]
 
-    # Create FAISS store using LangChain
-    faiss_store = FAISS.from_documents(docs, embedding=JinaEmbeddingWrapper.JinaEmbeddingWrapper(api_key=JINA_API_KEY))
+    # Wrap the index we just built (no second embedding pass) in a LangChain FAISS store
+    docstore_ids = [str(uuid.uuid4()) for _ in docs]
+    faiss_store = FAISS(
+        embedding_function=embedding_backend.query_embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(docstore_ids, docs))),
+        index_to_docstore_id=dict(enumerate(docstore_ids))
+    )
 
-    # Save FAISS index using save_local (writes .faiss and .pkl)
+    # Save FAISS index using save_local (writes .faiss and .pkl) plus the index type and parameters
     faiss_store.save_local(faiss_index_path)
+    report = build_report(index, embeddings, index_type, build_seconds)
+    write_index_info(faiss_index_path, {
+        "index_type": index_type,
+        "params": {**default_params(), **(params or {})},
+        "dimension": int(embeddings.shape[1]),
+        "embeddings_model": embedding_backend.model_name,
+        "report": report
+    })
 
     metadata_df = pd.DataFrame(metadata)
     metadata_df.to_csv(metadata_csv_path, index=False)
 
     print(f"FAISS index saved to {faiss_index_path}")
     print(f"Metadata saved to {metadata_csv_path}")
+    print(f"Index report: {report}")
     return faiss_store.index
 
 
+def benchmark_index_types(embeddings, params=None):
+    """Build every index type over the same vectors and report build time, memory and recall."""
+    for index_type in INDEX_TYPES:
+        index, build_seconds = timed_build(embeddings, index_type, params)
+        print(build_report(index, embeddings, index_type, build_seconds))
+
+
 # === Generate and Index ===
-def generate_and_index_embeddings(chunks, faiss_index_path=FAISS_INDEX_PATH, metadata_csv_path=METADATA_CSV_PATH):
+def generate_and_index_embeddings(chunks, faiss_index_path=None, metadata_csv_path=METADATA_CSV_PATH,
+                                  index_type=FAISS_INDEX_TYPE, params=None):
+    faiss_index_path = faiss_index_path or embedding_backend.index_path(FAISS_INDEX_PATH)
     texts = [chunk["text"] for chunk in chunks]
     metadata = [
         {
@@ -68,22 +102,36 @@ def generate_and_index_embeddings(chunks, faiss_index_path=FAISS_INDEX_PATH, met
             "book_name": chunk.get("book_name", ""),
             "book_type": chunk.get("book_type", ""),
             "page_number": chunk.get("page_number", None),
+            "also_pages": chunk.get("also_pages"),  # Pages of near-duplicates folded into this chunk
         }
         for chunk in chunks
     ]
 
-    print("Generating embeddings via Jina API...")
-    embeddings = get_jina_embeddings(texts)
+    print(f"Generating embeddings with {embedding_backend.model_name}...")
+    embeddings = get_embeddings(texts)
 
     print("Creating FAISS index...")
-    index = create_faiss_index(embeddings, metadata, faiss_index_path, metadata_csv_path)
+    index = create_faiss_index(embeddings, metadata, faiss_index_path, metadata_csv_path, index_type, params)
     return index
 
 
 # === Load from CSV and Run ===
 if __name__ == "__main__":
-    print(f"Loading chunks from: {CHUNKS_CSV_PATH}")
-    df = pd.read_csv(CHUNKS_CSV_PATH)
+    parser = argparse.ArgumentParser(description="Embed chunks and build the FAISS index.")
+    parser.add_argument("--chunks-csv", default=CHUNKS_CSV_PATH)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=FAISS_INDEX_TYPE)
+    parser.add_argument("--hnsw-m", type=int, dest="hnsw_m")
+    parser.add_argument("--ef-construction", type=int, dest="ef_construction")
+    parser.add_argument("--ef-search", type=int, dest="ef_search")
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare flat/hnsw/ivf on the embedded chunks instead of saving an index")
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k in default_params() and v is not None}
+
+    print(f"Loading chunks from: {args.chunks_csv}")
+    df = pd.read_csv(args.chunks_csv)
 
     # Ensure required columns exist
     required_columns = {"text", "chunk_id", "section_title", "topic"}
@@ -93,5 +141,8 @@ if __name__ == "__main__":
     # Convert to list of dicts
     chunks = df.to_dict(orient="records")
 
-    # Generate and index
-    generate_and_index_embeddings(chunks)
+    if args.benchmark:
+        benchmark_index_types(get_embeddings([chunk["text"] for chunk in chunks]), params)
+    else:
+        # Generate and index
+        generate_and_index_embeddings(chunks, index_type=args.index_type, params=params)